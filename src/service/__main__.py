@@ -2,9 +2,12 @@ from __future__ import annotations
 
 import sys
 
+from .bench import load as bench
 from .programs.program import Program
 from .programs.publisher import Publisher
 from .programs.server import Server
+from .programs.sharded_server import ShardedServer
+from .programs.state.retention import Retention
 from .programs.subscriber import Subscriber
 
 
@@ -19,7 +22,27 @@ def get_program(args: list) -> Program | None:
     type_of_program = args[0]
 
     if type_of_program == 'server':
-        return Server()
+        # The retention of every topic is read from the environment, as the configuration of the logs
+        try:
+            retention = Retention.from_environment()
+        except ValueError as e:
+            print_error(f"Invalid retention: {e}")
+        if len(args) == 2:
+            return ShardedServer(int(args[1]), retention=retention)
+        return Server(retention=retention)
+
+    # The publisher may be given a rate, in publications per second or "unbounded"
+    if type_of_program == 'publisher' and len(args) == 4:
+        if args[3] == 'unbounded':
+            return Publisher(args[1], args[2], rate=None)
+        try:
+            rate = float(args[3])
+        except ValueError:
+            return None
+        # nan is not greater than 0, and an infinite rate is given as unbounded
+        if not rate > 0 or rate == float('inf'):
+            return None
+        return Publisher(args[1], args[2], rate=rate)
 
     if len(args) != 3:
         return None
@@ -35,11 +58,16 @@ def get_program(args: list) -> Program | None:
 if __name__ == '__main__':
     "<program path> <subscriber|publisher|server>"
 
+    # The benchmark starts its own server and clients
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        bench.main(sys.argv[2:])
+        exit()
+
     if len(sys.argv) < 2:
-        print_error("Invalid arguments, expected: server | subscriber <messages> <id>| publisher <topics> <id>")
+        print_error("Invalid arguments, expected: server [<shards>] | subscriber <messages> <id>| publisher <topics> <id> [<rate>|unbounded] | bench [<options>]")
 
     program = get_program(sys.argv[1:])
     if program is None:
-        print_error("Invalid arguments, expected: server | subscriber <messages> <id>| publisher <topics> <id>")
+        print_error("Invalid arguments, expected: server [<shards>] | subscriber <messages> <id>| publisher <topics> <id> [<rate>|unbounded] | bench [<options>]")
 
     program.run()
@@ -0,0 +1,55 @@
+"""
+Encoding and decoding time of the text and binary codecs, per message of each kind.
+
+    python -m service.bench.codec [iterations] [content size]
+"""
+from __future__ import annotations
+
+import json
+import sys
+import time
+
+from ..programs.message.codecs import BINARY
+from ..programs.message.codecs import PARSERS
+
+
+def measure(function, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return round((time.perf_counter() - start) / iterations * 1e9, 1)
+
+
+def run(iterations: int, content_size: int) -> list:
+    results = []
+    for codec, parser in PARSERS.items():
+        # Each codec gets the contents in the type it carries them end to end
+        content = b"x" * content_size if codec == BINARY else "x" * content_size
+        batch = [7, "weather", 123456, *([content] * 10)]
+
+        publication = parser.encode_publication("weather", 1, content, 123456)
+        request = parser.encode_request("GET", "weather", 123456, 10, 0)
+        messages = parser.encode_messages(list(batch))[1:]
+
+        # Frames are copied before decoding, since the text codec decodes in place
+        results.append({
+            "codec": codec,
+            "content_size": content_size,
+            "publication_ns": measure(lambda: parser.decode_publication(list(
+                parser.encode_publication("weather", 1, content, 123456))), iterations),
+            "request_ns": measure(lambda: parser.decode_request(list(
+                parser.encode_request("GET", "weather", 123456, 10, 0))), iterations),
+            "batch_of_10_ns": measure(lambda: parser.decode_messages(list(
+                parser.encode_messages(list(batch))[1:])), iterations),
+            "publication_bytes": sum(len(frame) for frame in publication),
+            "request_bytes": sum(len(frame) for frame in request),
+            "batch_of_10_bytes": sum(len(frame) for frame in messages),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    for result in run(n, size):
+        print(json.dumps(result))
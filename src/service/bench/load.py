@@ -0,0 +1,245 @@
+"""
+End-to-end load of a broker on localhost: a server, publishers and subscribers run in their own
+processes, for every combination of topic count, content size and fan-out. Each combination
+prints a line of JSON with the throughput, the end-to-end latency and the CPU and RSS of the server.
+
+    python -m service bench [--topics 1,4] [--sizes 64,1024,16384] [--fanout 1,4] [--publishers 1]
+                            [--rate 5000] [--duration 3] [--window 1000] [--output results.json]
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+import zmq
+
+from ..programs.log.level import Level
+from ..programs.log.logger import Logger
+from ..programs.message.binary_parser import BinaryParser
+
+# Send time at the start of every content, in ns of the monotonic clock shared by the processes
+TIMESTAMP = struct.Struct('!q')
+# Seconds the publishers wait for the subscriptions to reach them
+JOIN_DELAY = 1.0
+# Seconds the subscribers keep receiving after the publishers stop
+DRAIN_DELAY = 1.0
+# Publications sent between each check of the rate
+PUBLISH_BATCH = 50
+
+
+# --------------------------------------------------------------------------
+# Processes
+# --------------------------------------------------------------------------
+
+def run_server(directory: str) -> None:
+    from ..programs.server import Server
+
+    # The server keeps its state in the data directory of the working directory
+    os.chdir(directory)
+    os.makedirs("data", exist_ok=True)
+    Logger.configure(level=Level.OFF)
+    Server().run()
+
+
+def run_publisher(pub_id: int, topics: list, size: int, rate: float, duration: float, results) -> None:
+    context = zmq.Context()
+    socket = context.socket(zmq.PUB)
+    socket.connect("tcp://localhost:5556")
+    time.sleep(JOIN_DELAY)
+
+    padding = b"x" * max(0, size - TIMESTAMP.size)
+    next_ids = [0] * len(topics)
+    published = 0
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        for _ in range(PUBLISH_BATCH):
+            index = published % len(topics)
+            content = TIMESTAMP.pack(time.monotonic_ns()) + padding
+            socket.send_multipart(BinaryParser.encode_publication(topics[index], pub_id, content, next_ids[index]))
+            next_ids[index] += 1
+            published += 1
+
+        # The schedule is kept from the start, as in the rate mode of the publisher
+        if rate:
+            pause = started + published / rate - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+
+    results.put(("published", published))
+    socket.close(linger=1000)
+    context.term()
+
+
+def run_subscriber(client_id: int, topic: str, window: int, duration: float, ready, results) -> None:
+    context = zmq.Context()
+    dealer = context.socket(zmq.DEALER)
+    dealer.setsockopt_string(zmq.IDENTITY, str(client_id))
+    dealer.connect("tcp://localhost:5554")
+
+    dealer.send_multipart(BinaryParser.encode_request("SUB", topic))
+    dealer.send_multipart(BinaryParser.encode_request("STREAM", topic, 0, window))
+    ready.release()
+
+    latencies = array('q')
+    deadline = time.monotonic() + JOIN_DELAY + duration + DRAIN_DELAY
+    while time.monotonic() < deadline:
+        if not dealer.poll(100):
+            continue
+        _, first_id, contents = BinaryParser.decode_messages(dealer.recv_multipart())
+        now = time.monotonic_ns()
+        for content in contents:
+            latencies.append(now - TIMESTAMP.unpack_from(content)[0])
+        # A single cumulative ACK gives the credit of the whole run back
+        dealer.send_multipart(BinaryParser.encode_request("ACK", topic, first_id + len(contents) - 1))
+
+    dealer.send_multipart(BinaryParser.encode_request("UNSUB", topic))
+    results.put(("latencies", latencies.tobytes()))
+    dealer.close(linger=1000)
+    context.term()
+
+
+# --------------------------------------------------------------------------
+# Measurements
+# --------------------------------------------------------------------------
+
+def cpu_seconds(pid: int) -> float | None:
+    """
+    Returns the user and system time of a process, None where /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The name of the process may have spaces, the fields are counted after it
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: list, fraction: float) -> float | None:
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(fraction * len(values)))] / 1e6, 3)
+
+
+# --------------------------------------------------------------------------
+# Scenarios
+# --------------------------------------------------------------------------
+
+def run_scenario(n_topics: int, size: int, fanout: int, n_publishers: int, rate: float, duration: float,
+                 window: int) -> dict:
+    spawn = multiprocessing.get_context('spawn')
+    results = spawn.Queue()
+    topics = [f"bench{index}" for index in range(n_topics)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = spawn.Process(target=run_server, args=(directory,), daemon=True)
+        server.start()
+        time.sleep(0.5)
+
+        subscribers = []
+        ready = spawn.Semaphore(0)
+        for client_id, (topic, _) in enumerate(itertools.product(topics, range(fanout))):
+            process = spawn.Process(target=run_subscriber, args=(client_id, topic, window, duration, ready, results))
+            process.start()
+            subscribers.append(process)
+        for _ in subscribers:
+            ready.acquire()
+
+        # Each publisher gets its share of the rate
+        publishers = []
+        publisher_rate = rate / n_publishers if rate else 0
+        for pub_id in range(n_publishers):
+            process = spawn.Process(target=run_publisher,
+                                    args=(pub_id, topics, size, publisher_rate, duration, results))
+            process.start()
+            publishers.append(process)
+
+        # The CPU of the server is measured while the publishers send
+        time.sleep(JOIN_DELAY)
+        cpu_start = cpu_seconds(server.pid)
+        time.sleep(duration)
+        cpu_end = cpu_seconds(server.pid)
+
+        published, latencies = 0, []
+        for _ in range(len(publishers) + len(subscribers)):
+            kind, value = results.get()
+            if kind == "published":
+                published += value
+            else:
+                latencies.extend(array('q', value))
+
+        for process in publishers + subscribers:
+            process.join()
+        rss = peak_rss_mb(server.pid)
+        server.terminate()
+        server.join()
+
+    latencies.sort()
+    cpu = None
+    if cpu_start is not None and cpu_end is not None:
+        cpu = round((cpu_end - cpu_start) / duration * 100, 1)
+    return {
+        "topics": n_topics,
+        "content_size": size,
+        "fanout": fanout,
+        "publishers": n_publishers,
+        "published_per_s": round(published / duration, 1),
+        "delivered_per_s": round(len(latencies) / duration, 1),
+        "delivered_ratio": round(len(latencies) / (published * fanout), 4) if published else None,
+        "latency_p50_ms": percentile(latencies, 0.5),
+        "latency_p99_ms": percentile(latencies, 0.99),
+        "latency_p999_ms": percentile(latencies, 0.999),
+        "server_cpu_percent": cpu,
+        "server_peak_rss_mb": rss,
+    }
+
+
+def parse_list(value: str) -> list:
+    return [int(item) for item in value.split(",")]
+
+
+def main(args: list) -> None:
+    parser = argparse.ArgumentParser(prog="python -m service bench")
+    parser.add_argument("--topics", type=parse_list, default=[1, 4])
+    parser.add_argument("--sizes", type=parse_list, default=[64, 1024, 16384])
+    parser.add_argument("--fanout", type=parse_list, default=[1, 4])
+    parser.add_argument("--publishers", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=5000, help="publications per second, 0 for unbounded")
+    parser.add_argument("--duration", type=float, default=3)
+    parser.add_argument("--window", type=int, default=1000, help="credit of the streaming subscribers")
+    parser.add_argument("--output", help="file where the results are written as a JSON list")
+    options = parser.parse_args(args)
+
+    results = []
+    for n_topics, size, fanout in itertools.product(options.topics, options.sizes, options.fanout):
+        result = run_scenario(n_topics, size, fanout, options.publishers, options.rate, options.duration,
+                              options.window)
+        print(json.dumps(result), flush=True)
+        results.append(result)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,62 @@
+"""
+Publish latency of ServerState as the number of retained messages grows.
+
+    python -m service.bench.topic_log [max retained messages]
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+from ..programs.state.server_state import ServerState
+
+# Publications timed at each retention level
+SAMPLE_SIZE = 10000
+
+
+def measure(state: ServerState, topic: str, client_id: int) -> dict:
+    retained = len(state.topic_dict[topic])
+
+    start = time.perf_counter()
+    for _ in range(SAMPLE_SIZE):
+        state.add_message(topic, b"message")
+    publish = (time.perf_counter() - start) / SAMPLE_SIZE
+
+    # Lookups of the oldest retained message, the worst case of a dict key scan
+    start = time.perf_counter()
+    for _ in range(SAMPLE_SIZE):
+        state.message_for_client(client_id, topic)
+    lookup = (time.perf_counter() - start) / SAMPLE_SIZE
+
+    return {
+        "retained": retained,
+        "publish_us": round(publish * 1e6, 3),
+        "lookup_us": round(lookup * 1e6, 3),
+    }
+
+
+def run(max_retained: int, directory: str) -> list:
+    # The state is never opened with a journal, only the segments of the messages are written
+    state = ServerState(os.path.join(directory, "bench.pkl"))
+    topic, client_id = "bench", 0
+    state.add_subscriber(client_id, topic)
+
+    results = []
+    retained = 1000
+    while retained <= max_retained:
+        while len(state.topic_dict[topic]) < retained:
+            state.add_message(topic, b"message")
+        results.append(measure(state, topic, client_id))
+        retained *= 10
+    return results
+
+
+if __name__ == '__main__':
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as data_directory:
+        results = run(limit, data_directory)
+    for result in results:
+        print(json.dumps(result))
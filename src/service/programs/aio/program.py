@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import zmq.asyncio
+
+from ..program import Program
+
+
+class AsyncProgram(Program, ABC):
+    """
+    Program with asyncio sockets, so many of them can run in the same event loop.
+    Blocking writes to disk are done by an executor, the logs are already written by their own thread.
+    """
+
+    # Single thread, so the writes keep their order
+    persistence_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+
+    def create_context(self) -> zmq.asyncio.Context:
+        # Every program of the process shares the context and its IO thread
+        return zmq.asyncio.Context.instance()
+
+    def persist(self, function, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(AsyncProgram.persistence_executor, function, *args)
+
+    @abstractmethod
+    async def run(self):
+        pass
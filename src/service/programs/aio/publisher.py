@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import zmq
+
+from ..log.logger import Logger
+from ..publisher import Publisher
+from .program import AsyncProgram
+
+
+class AsyncPublisher(AsyncProgram, Publisher):
+    """
+    Publisher running in an asyncio event loop, its state is saved by the persistence executor.
+    """
+
+    # --------------------------------------------------------------------------
+    # Publications, the sends of the asyncio sockets are awaited
+    # --------------------------------------------------------------------------
+
+    async def put(self, topic: str, msg_id: int, content: str) -> None:
+        await self.publisher.send_multipart(self.parser.encode_publication(topic, self.id, content, msg_id))
+        Logger.put_message(self.id, topic, msg_id, content)
+
+    async def publication(self) -> None:
+        await self.put(*self.next_publication())
+
+    async def publish_batch(self) -> None:
+        for _ in range(self.batch_size):
+            await self.publication()
+
+    async def resend(self, message: list) -> None:
+        for topic, msg_id, content in self.lost_publications(message):
+            await self.put(topic, msg_id, content)
+
+    # --------------------------------------------------------------------------
+    # Main function of publisher
+    # --------------------------------------------------------------------------
+
+    async def handle_fault(self) -> None:
+        """
+        Drains every fault message sent by the server and resends the ranges of lost messages
+        """
+        while True:
+            try:
+                message = await self.fault_server.recv_multipart(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            await self.resend(message)
+
+    async def run(self) -> None:
+        self.started = time.monotonic()
+        try:
+            while True:
+                # Send publications
+                await self.publish_batch()
+
+                # Handles lost messages from the server.
+                await self.handle_fault()
+
+                if self.checkpoint_due():
+                    self.mark_checkpoint()
+                    # The dictionary is copied, since it keeps changing while it's written
+                    await self.persist(self.write_state, dict(self.put_topic_dict))
+                await asyncio.sleep(self.pause())
+
+        except asyncio.CancelledError:
+            self.save_state()
+            Logger.err("Publisher cancelled")
+            raise
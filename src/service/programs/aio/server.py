@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import zmq
+import zmq.asyncio
+
+from ..log.logger import Logger
+from ..server import Server
+from .program import AsyncProgram
+
+
+class AsyncServer(AsyncProgram, Server):
+    """
+    Server running in an asyncio event loop. The messages are handled as in Server,
+    while the journal is committed by the persistence executor.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    poller: zmq.asyncio.Poller
+    persisting: asyncio.Future | None  # Commit being written by the persistence executor
+
+    # --------------------------------------------------------------------------
+    # Initialization of server
+    # --------------------------------------------------------------------------
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.persisting = None
+
+    def create_poller(self) -> None:
+        self.poller = zmq.asyncio.Poller()
+        self.poller.register(self.backend, zmq.POLLIN)
+        self.poller.register(self.router, zmq.POLLIN)
+        self.poller.register(self.sync_sub, zmq.POLLIN)
+        if self.stats is not None:
+            self.poller.register(self.stats, zmq.POLLIN)
+
+    # --------------------------------------------------------------------------
+    #  Sending of messages
+    # --------------------------------------------------------------------------
+
+    async def flush(self) -> None:
+        outbox, self.outbox = self.outbox, []
+        await asyncio.gather(*(socket.send_multipart(frames, copy=False) for socket, frames in outbox))
+
+    # --------------------------------------------------------------------------
+    # Main function of server
+    # --------------------------------------------------------------------------
+
+    async def drain(self, socket: zmq.asyncio.Socket, handler) -> None:
+        for _ in range(self.fairness_budget):
+            try:
+                raw_message = await socket.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            handler(raw_message)
+
+    def is_persisting(self) -> bool:
+        return self.persisting is not None and not self.persisting.done()
+
+    def poll_timeout(self) -> float | None:
+        # The next commit waits for the one being written, only the GETs may expire before
+        if self.is_persisting():
+            timeout = self.commit_interval * 1000
+            if self.get_deadlines:
+                timeout = min(timeout, max(0.0, (self.get_deadlines[0][0] - time.monotonic()) * 1000))
+            return timeout
+        return super().poll_timeout()
+
+    def commit(self) -> None:
+        """
+        Hands the pending mutations to the persistence executor. Only one commit is written at a time,
+        the mutations keep being grouped for the next one meanwhile.
+        """
+        if self.is_persisting():
+            return
+        if self.persisting is not None:
+            # Raises the errors of the last commit
+            self.persisting.result()
+            self.persisting = None
+
+        pending = self.state.pending_mutations()
+        if pending == 0:
+            self.last_commit = time.monotonic()
+            return
+
+        if pending >= self.commit_mutations or time.monotonic() - self.last_commit >= self.commit_interval:
+            self.persisting = self.persist(self.state.write_commit, *self.state.prepare_commit())
+            self.last_commit = time.monotonic()
+            self.metrics.increment('commits')
+
+            # The latency is observed in the loop once the executor finishes
+            started = self.last_commit
+            self.persisting.add_done_callback(
+                lambda _: self.metrics.observe('persistence', time.monotonic() - started))
+
+    async def run(self) -> None:
+        try:
+            # Forwards the subscriptions restored before the first wakeup
+            await self.flush()
+            while True:
+                socks = dict(await self.poller.poll(self.poll_timeout()))
+                woken = time.monotonic()
+
+                # Receives content from publishers
+                if socks.get(self.backend) == zmq.POLLIN:
+                    await self.drain(self.backend, self.handle_publication)
+
+                # Receives message from subscribers
+                if socks.get(self.router) == zmq.POLLIN:
+                    await self.drain(self.router, self.handle_dealer)
+
+                # Receives synchronization requests from subscribers
+                if socks.get(self.sync_sub) == zmq.POLLIN:
+                    await self.drain(self.sync_sub, self.handle_sub_sync)
+
+                # Answers the requests of the metrics
+                if self.stats is not None and socks.get(self.stats) == zmq.POLLIN:
+                    await self.drain(self.stats, self.handle_stats)
+
+                # Answers the GETs that waited too long
+                self.expire_gets()
+
+                # Sends every reply of this wakeup and commits the mutations journaled
+                await self.flush()
+                self.commit()
+                self.dump_metrics()
+                self.metrics.observe('poll_iteration', time.monotonic() - woken)
+        except asyncio.CancelledError:
+            if self.persisting is not None:
+                await self.persisting
+            self.state.save_state()
+            Logger.err("Server cancelled")
+            raise
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+
+from ..log.logger import Logger
+from ..subscriber import Subscriber
+from .program import AsyncProgram
+
+
+class AsyncSubscriber(AsyncProgram, Subscriber):
+    """
+    Subscriber running in an asyncio event loop, its state is saved by the persistence executor.
+    The session with the server is only started by run, since it may have to wait for the server.
+    """
+
+    def start_session(self, data_path: str) -> None:
+        self.data_path = data_path
+
+    async def resume_session(self) -> None:
+        # Subscribe if the subscriber is new, handle crash otherwise
+        if self.state.is_new_subscriber(self.data_path):
+            await self.subscribe_topics()
+            await self.persist(self.state.save_state)
+        else:
+            await self.handle_crash()
+
+    # --------------------------------------------------------------------------
+    # Requests, the sends of the asyncio sockets are awaited
+    # --------------------------------------------------------------------------
+
+    async def subscribe_topics(self) -> None:
+        for topic in self.state.topics:
+            await self.subscribe(topic)
+            Logger.subscribe(topic)
+
+    async def unsubscribe_topics(self) -> None:
+        for topic in self.state.topics:
+            await self.unsubscribe(topic)
+            Logger.unsubscribe(topic)
+
+    async def subscribe(self, topic: str) -> None:
+        await self.dealer.send_multipart(self.parser.encode_request("SUB", topic))
+
+    async def unsubscribe(self, topic: str) -> None:
+        await self.dealer.send_multipart(self.parser.encode_request("UNSUB", topic))
+
+    async def get(self, topic: str) -> None:
+        await self.acknowledge()
+        await self.dealer.send_multipart(self.get_request(topic))
+        Logger.get(self.id, topic)
+
+    async def multi_get(self, topics: list) -> None:
+        await self.acknowledge()
+        await self.dealer.send_multipart(self.multi_get_request(topics))
+        Logger.multi_get(self.id, topics)
+
+    async def stream(self, topic: str, window: int) -> None:
+        await self.acknowledge()
+        await self.dealer.send_multipart(self.stream_request(topic, window))
+        Logger.stream(self.id, topic, window)
+
+    # --------------------------------------------------------------------------
+    # Message handling
+    # --------------------------------------------------------------------------
+
+    async def handle_crash(self) -> None:
+        """ Send ACK to the last topic requested with a GET before crashing.
+        Send SYNC message to know if he crashed while waiting for an answer to GET.
+        """
+        # Send last ACK
+        ack_message = self.state.get_last_ack()
+        if ack_message is not None:
+            await self.dealer.send_multipart(self.parser.encode_request(*ack_message))
+
+        # SYNC with the server
+        await self.sync_with_server()
+
+    async def sync_with_server(self) -> None:
+        if self.state.last_get is None:
+            return
+
+        await self.sync.send(self.state.last_get.encode("utf-8"))
+        answer = (await self.sync.recv()).decode("utf-8")
+
+        if answer == "WAITING":
+            # Wait for answer to GET
+            await self.handle_msg()
+        elif answer == "NOT WAITING" and await self.dealer.poll(250):
+            # A GET response is in the queue
+            await self.handle_msg()
+
+    async def handle_msg(self) -> None:
+        """ This function receive the runs of consecutive messages of a reply, their ACKs are held until the
+        checkpoint is synced. """
+
+        for request in self.receive(await self.dealer.recv_multipart()):
+            await self.dealer.send_multipart(request)
+
+        if self.state.needs_sync() or self.stream_stalled():
+            await self.acknowledge()
+
+    async def acknowledge(self) -> None:
+        if not self.held_acks:
+            return
+        await self.persist(self.state.sync)
+        for request in self.release_acks():
+            await self.dealer.send_multipart(request)
+
+    async def run(self) -> None:
+        await self.resume_session()
+        if self.stream_window > 0:
+            await self.run_stream()
+            return
+
+        try:
+            for i in range(5):
+                # Get messages from every subscribed topic
+                await self.multi_get(self.rotated_topics(i))
+
+                # Send ACKs
+                await self.handle_msg()
+
+        except asyncio.CancelledError:
+            self.state.save_state()
+            Logger.err("Subscriber cancelled")
+            raise
+
+        await self.unsubscribe_topics()
+        await self.persist(self.state.delete)
+
+    async def run_stream(self) -> None:
+        """ Receives the messages pushed by the server, acknowledging each run to replenish the credit. """
+        for topic in self.state.topics:
+            await self.stream(topic, self.stream_window)
+
+        try:
+            for i in range(5):
+                await self.handle_msg()
+
+        except asyncio.CancelledError:
+            self.state.save_state()
+            Logger.err("Subscriber cancelled")
+            raise
+
+        for topic in self.state.topics:
+            await self.stream(topic, 0)
+        await self.unsubscribe_topics()
+        await self.persist(self.state.delete)
@@ -0,0 +1,2 @@
+class InvalidLogLevel(Exception):
+    pass
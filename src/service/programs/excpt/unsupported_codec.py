@@ -0,0 +1,2 @@
+class UnsupportedCodec(Exception):
+    pass
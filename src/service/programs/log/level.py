@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from ..excpt.invalid_log_level import InvalidLogLevel
+
+
+class Level:
+    """
+    Severity of the logs, only the ones at or above the level of the logger are written
+    """
+
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+    OFF = 100  # Disables every log
+
+    NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error", OFF: "off"}
+
+    @staticmethod
+    def parse(level: int | str) -> int:
+        """
+        Returns the level given by its value or its name
+        """
+        if isinstance(level, int):
+            return level
+        for value, name in Level.NAMES.items():
+            if name == level.lower():
+                return value
+        raise InvalidLogLevel(level)
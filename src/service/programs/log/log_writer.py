@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import deque
+
+from .level import Level
+
+
+class LogWriter:
+    """
+    Background thread that takes the records queued by the loggers and writes them in batches.
+    The records are only formatted here, so the thread that logs them never formats nor writes.
+    A record is (timestamp, level, category, color, template, fields).
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    RESET_STYLE = '\033[0;0m'
+
+    records: deque  # Records not written yet, appended and popped without a lock
+    max_records: int  # Records queued before the new ones are dropped
+    output: object  # File where the records are written
+    colors: bool
+    json: bool  # Writes each record as a JSON object instead of a line of text
+    interval: float  # Seconds between each batch
+    suppressed: dict  # suppressed[<category>] = records sampled out, rate limited or dropped
+    reported: dict  # reported[<category>] = suppressed records already reported
+    stopped: threading.Event
+    thread: threading.Thread | None
+
+    def __init__(self, output, colors: bool = False, json: bool = False,
+                 interval: float = 0.1, max_records: int = 100000) -> None:
+        self.records = deque()
+        self.max_records = max_records
+        self.output = output
+        self.colors = colors
+        self.json = json
+        self.interval = interval
+        self.suppressed = {}
+        self.reported = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # --------------------------------------------------------------------------
+    # Producers
+    # --------------------------------------------------------------------------
+
+    def put(self, record: tuple) -> None:
+        if len(self.records) >= self.max_records:
+            self.suppress(record[2])
+            return
+        self.records.append(record)
+
+        if self.thread is None:
+            self.start()
+
+    def suppress(self, category: str) -> None:
+        # Only the producer updates the counts, the writer keeps apart the ones it already reported
+        self.suppressed[category] = self.suppressed.get(category, 0) + 1
+
+    # --------------------------------------------------------------------------
+    # Writer thread
+    # --------------------------------------------------------------------------
+
+    def start(self) -> None:
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="logging", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Writes the records left and stops the thread
+        """
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.write_batch()
+        self.write_batch()
+
+    def write_batch(self) -> None:
+        lines = []
+        while self.records:
+            lines.append(self.format(self.records.popleft()))
+
+        for category, count in self.suppressed.copy().items():
+            reported = self.reported.get(category, 0)
+            if count > reported:
+                self.reported[category] = count
+                lines.append(self.format((time.time(), Level.WARNING, "LOG", None,
+                                          "{count} records of {suppressed} were not logged",
+                                          {'count': count - reported, 'suppressed': category})))
+
+        if lines:
+            self.output.write("".join(lines))
+            self.output.flush()
+
+    def format(self, record: tuple) -> str:
+        timestamp, level, category, color, template, fields = record
+        message = template.format(**fields)
+        if self.json:
+            return json.dumps({'time': timestamp, 'level': Level.NAMES[level], 'category': category,
+                               'message': message, **fields}, default=str) + "\n"
+
+        line = f"[{category}] {message}" if category else message
+        if self.colors and color is not None:
+            line = f"{color}{line}{LogWriter.RESET_STYLE}"
+        return line + "\n"
@@ -1,4 +1,12 @@
+from __future__ import annotations
+
+import atexit
+import os
 import sys
+import time
+
+from .level import Level
+from .log_writer import LogWriter
 
 
 class Colors:
@@ -11,14 +19,97 @@ class Colors:
 
 
 class Logger:
+    """
+    Logs of the programs, each one with a level and a category, the tag shown between brackets.
+    A log below the level returns before building anything. The others are queued as records,
+    formatted and written in batches by the thread of the writer.
+    """
+
+    level = Level.INFO
+    writer = LogWriter(sys.stdout, colors=sys.stdout.isatty())
+    sampling = {}  # sampling[<category>] = only one of every n records of the category is logged
+    rate_limits = {}  # rate_limits[<category>] = records of the category logged per second
+    counts = {}  # counts[<category>] = records of the category seen by the sampling
+    allowances = {}  # allowances[<category>] = (records that can still be logged, time it was computed)
+
+    @staticmethod
+    def configure(level: int | str = Level.INFO, output: str = None, colors: bool = None, json: bool = False,
+                  sampling: dict = None, rate_limits: dict = None) -> None:
+        """
+        Replaces the writer, writing to the output file or to stdout if there is none.
+        The colors are only added to a terminal, unless they are requested.
+        """
+        Logger.writer.stop()
+        if Logger.writer.output is not sys.stdout:
+            Logger.writer.output.close()
+        stream = sys.stdout if output is None else open(output, "a")
+        colors = stream.isatty() if colors is None else colors
+        Logger.writer = LogWriter(stream, colors=colors, json=json)
+
+        Logger.level = Level.parse(level)
+        Logger.sampling = sampling or {}
+        Logger.rate_limits = rate_limits or {}
+        Logger.counts = {}
+        Logger.allowances = {}
 
     @staticmethod
-    def add_color(color: str) -> None:
-        sys.stdout.write(color)
+    def configure_from_environment() -> None:
+        """
+        Configures the logs with LOG_LEVEL, LOG_FILE, LOG_COLORS and LOG_FORMAT, which the
+        processes started by a program also read
+        """
+        colors = os.environ.get("LOG_COLORS")
+        Logger.configure(level=os.environ.get("LOG_LEVEL", "info"), output=os.environ.get("LOG_FILE"),
+                         colors=None if colors is None else colors == "1", json=os.environ.get("LOG_FORMAT") == "json")
 
     @staticmethod
-    def reset_colors() -> None:
-        sys.stdout.write('\033[0;0m')
+    def restart_after_fork() -> None:
+        # The thread of the writer does not exist in the child, and the records are written by the parent
+        Logger.writer.thread = None
+        Logger.writer.records.clear()
+
+    @staticmethod
+    def admit(category: str) -> bool:
+        """
+        Returns true if a record of the category passes the sampling and the rate limit
+        """
+        every = Logger.sampling.get(category)
+        if every is not None:
+            count = Logger.counts[category] = Logger.counts.get(category, 0) + 1
+            if count % every:
+                Logger.writer.suppress(category)
+                return False
+
+        rate = Logger.rate_limits.get(category)
+        if rate is not None:
+            now = time.monotonic()
+            allowance, last = Logger.allowances.get(category, (rate, now))
+            allowance = min(rate, allowance + (now - last) * rate)
+            if allowance < 1:
+                Logger.allowances[category] = (allowance, now)
+                Logger.writer.suppress(category)
+                return False
+            Logger.allowances[category] = (allowance - 1, now)
+
+        return True
+
+    @staticmethod
+    def log(level: int, category: str | None, color: str | None, template: str, **fields) -> None:
+        """
+        Queues a record, the template is formatted with the fields by the writer
+        """
+        if level < Logger.level:
+            return
+        if (Logger.sampling or Logger.rate_limits) and not Logger.admit(category):
+            return
+        Logger.writer.put((time.time(), level, category, color, template, fields))
+
+    @staticmethod
+    def printable(content, limit: int = None) -> str:
+        # The server keeps the contents as bytes or frames, only the part that is shown is copied
+        if not isinstance(content, str):
+            content = bytes(memoryview(content)[:limit]).decode('utf-8', 'replace')
+        return content
 
     # --------------------------------------------------------------------------
     # Server logs
@@ -27,103 +118,183 @@ class Logger:
     @staticmethod
     def new_message(message: list) -> None:
         return
-        print("\n" + "-" * 80)
-        print(f"{message}")
-        print("-" * 80)
+        Logger.log(Level.DEBUG, None, None, "\n{line}\n{message}\n{line}", line="-" * 80, message=message)
 
     @staticmethod
     def subscription(client_id: int, topic: str) -> None:
-        Logger.add_color(Colors.CYAN)
-        print(f"[SUB] uid({client_id}) - t('{topic}')")
-        Logger.reset_colors()
+        Logger.log(Level.INFO, "SUB", Colors.CYAN, "uid({client_id}) - t('{topic}')",
+                   client_id=client_id, topic=topic)
 
     @staticmethod
     def unsubscription(client_id: int, topic: str) -> None:
-        Logger.add_color(Colors.CYAN)
-        print(f"[UNSUB] uid({client_id}) - t('{topic}')")
-        Logger.reset_colors()
+        Logger.log(Level.INFO, "UNSUB", Colors.CYAN, "uid({client_id}) - t('{topic}')",
+                   client_id=client_id, topic=topic)
 
     @staticmethod
     def sync(client_id: int, topic: str, is_waiting: bool):
-        client_state = "yes" if is_waiting else "no"
-        Logger.add_color(Colors.PURPLE)
-        print(f"[SYNC] uid({client_id}) - t('{topic}') - waiting({client_state})")
-        Logger.reset_colors()
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "SYNC", Colors.PURPLE, "uid({client_id}) - t('{topic}') - waiting({waiting})",
+                   client_id=client_id, topic=topic, waiting="yes" if is_waiting else "no")
+
+    @staticmethod
+    def stream(client_id: int, topic: str, window: int):
+        Logger.log(Level.INFO, "STREAM", Colors.CYAN, "uid({client_id}) - t('{topic}') - window({window})",
+                   client_id=client_id, topic=topic, window=window)
 
     @staticmethod
-    def publication(topic: str, message_id: int, message: str):
+    def publication(topic: str, message_id: int, message):
+        if Logger.level > Level.DEBUG:
+            return
+        message = Logger.printable(message, 51)
         if len(message) > 50:
             message = message[:50] + "..."
-        print(f"[PUT] t('{topic}') - msgid({message_id}) - msg('{message}')")
+        Logger.log(Level.DEBUG, "PUT", None, "t('{topic}') - msgid({msg_id}) - msg('{content}')",
+                   topic=topic, msg_id=message_id, content=message)
+
+    @staticmethod
+    def rejected(pub_id: int, pub_msg_id: int, topic: str):
+        Logger.log(Level.WARNING, "REJECT", Colors.YELLOW, "The publication {pub_msg_id} of {pub_id} was rejected, "
+                   "'{topic}' is full", pub_id=pub_id, pub_msg_id=pub_msg_id, topic=topic)
 
     @staticmethod
     def request(client_id: int, topic: str):
-        print(f"[GET] uid({client_id}) - t('{topic}')")
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "GET", None, "uid({client_id}) - t('{topic}')", client_id=client_id, topic=topic)
+
+    @staticmethod
+    def multi_request(client_id: int, n_topics: int):
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "MGET", None, "uid({client_id}) - topics({n_topics})",
+                   client_id=client_id, n_topics=n_topics)
+
+    @staticmethod
+    def waiting(client_id: int, topic: str):
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "WAIT", Colors.YELLOW, "uid({client_id}) - t('{topic}')",
+                   client_id=client_id, topic=topic)
+
+    @staticmethod
+    def expired(client_id: int, topic: str):
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "EXPIRE", Colors.YELLOW, "uid({client_id}) - t('{topic}')",
+                   client_id=client_id, topic=topic)
+
+    @staticmethod
+    def sent(client_id: int, topic: str, first_id: int, count: int, pushed: bool = False):
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "PUSH" if pushed else "SEND", Colors.GREEN,
+                   "uid({client_id}) - t('{topic}') - msgids({first_id} to {last_id})",
+                   client_id=client_id, topic=topic, first_id=first_id, last_id=first_id + count - 1)
+
+    @staticmethod
+    def not_subscribed(client_id: int, topic: str):
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "NOSUB", Colors.YELLOW, "uid({client_id}) - t('{topic}')",
+                   client_id=client_id, topic=topic)
+
+    @staticmethod
+    def woken(topic: str, first_id: int, count: int, client_ids: list) -> None:
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "WAKE", Colors.GREEN,
+                   "t('{topic}') - msgids({first_id} to {last_id}) - uids({client_ids})", topic=topic,
+                   first_id=first_id, last_id=first_id + count - 1, client_ids=list(client_ids))
+
+    @staticmethod
+    def lost_ack(client_id: int, topic: str, last_id: int, msg_id: int):
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "SKIP", None, "uid({client_id}) - t('{topic}') - last acked({last_id}) - "
+                   "requested({msg_id})", client_id=client_id, topic=topic, last_id=last_id, msg_id=msg_id)
 
     @staticmethod
     def acknowledgement(client_id: int, topic: str, message_id: int):
-        Logger.add_color(Colors.GREEN)
-        print(f"[ACK] uid({client_id}) - t('{topic}') - msgid({message_id})")
-        Logger.reset_colors()
+        if Logger.level > Level.DEBUG:
+            return
+        Logger.log(Level.DEBUG, "ACK", Colors.GREEN, "uid({client_id}) - t('{topic}') - msgid({msg_id})",
+                   client_id=client_id, topic=topic, msg_id=message_id)
 
     @staticmethod
-    def info(message="", end="\n"):
-        print(message, end=end)
+    def info(message=""):
+        Logger.log(Level.INFO, None, None, "{message}", message=message)
 
     @staticmethod
-    def success(message="", end="\n"):
-        Logger.add_color(Colors.GREEN)
-        print(message, end=end)
-        Logger.reset_colors()
+    def success(message=""):
+        Logger.log(Level.INFO, None, Colors.GREEN, "{message}", message=message)
 
     @staticmethod
     def warning(message):
-        Logger.add_color(Colors.YELLOW)
-        print(message)
-        Logger.reset_colors()
+        Logger.log(Level.WARNING, None, Colors.YELLOW, "{message}", message=message)
 
     @staticmethod
     def err(message):
-        Logger.add_color(Colors.RED)
-        print(f"[ERR] {message}")
-        Logger.reset_colors()
+        Logger.log(Level.ERROR, "ERR", Colors.RED, "{message}", message=message)
 
     # --------------------------------------------------------------------------
     # Subscriber logs
     # --------------------------------------------------------------------------
 
     @staticmethod
-    def topic_message(topic: str, msg_id: int, content: str) -> None:
-        Logger.add_color(Colors.GREEN)
-        print(f"[RCV] t('{topic}') - msgid({msg_id}) - msg('{content}')")
-        Logger.reset_colors()
+    def topic_message(topic: str, msg_id: int, content) -> None:
+        if Logger.level > Level.INFO:
+            return
+        Logger.log(Level.INFO, "RCV", Colors.GREEN, "t('{topic}') - msgid({msg_id}) - msg('{content}')",
+                   topic=topic, msg_id=msg_id, content=Logger.printable(content))
+
+    @staticmethod
+    def timeout(topic: str) -> None:
+        Logger.log(Level.INFO, "TIMEOUT", Colors.YELLOW, "t('{topic}') - no messages", topic=topic)
 
     @staticmethod
     def get(identity: int, topic: str) -> None:
-        print(f"[GET] uid({identity}) - t('{topic}') ")
+        Logger.log(Level.INFO, "GET", None, "uid({client_id}) - t('{topic}')", client_id=identity, topic=topic)
+
+    @staticmethod
+    def multi_get(identity: int, topics: list) -> None:
+        Logger.log(Level.INFO, "MGET", None, "uid({client_id}) - t({topics})", client_id=identity, topics=topics)
+
+    @staticmethod
+    def resubscribe(topic: str) -> None:
+        Logger.log(Level.WARNING, "RESUB", Colors.YELLOW, "t('{topic}') - no longer subscribed, subscribing again",
+                   topic=topic)
 
     @staticmethod
     def subscribe(topic: str) -> None:
-        Logger.add_color(Colors.CYAN)
-        print(f"[SUB] t'({topic}')")
-        Logger.reset_colors()
+        Logger.log(Level.INFO, "SUB", Colors.CYAN, "t('{topic}')", topic=topic)
 
     @staticmethod
     def unsubscribe(topic: str) -> None:
-        Logger.add_color(Colors.CYAN)
-        print(f"[UNSUB] t('{topic}')")
-        Logger.reset_colors()
+        Logger.log(Level.INFO, "UNSUB", Colors.CYAN, "t('{topic}')", topic=topic)
 
     # --------------------------------------------------------------------------
     # Publisher logs
     # --------------------------------------------------------------------------
 
     @staticmethod
-    def put_message(pub_id: str, topic: str, msg_id: int, content: str) -> None:
-        print(f"[SENT] id({pub_id}) - t('{topic}') - msgid({msg_id}) - msg('{content}')")
+    def put_message(pub_id: str, topic: str, msg_id: int, content) -> None:
+        if Logger.level > Level.INFO:
+            return
+        Logger.log(Level.INFO, "SENT", None, "id({pub_id}) - t('{topic}') - msgid({msg_id}) - msg('{content}')",
+                   pub_id=pub_id, topic=topic, msg_id=msg_id, content=Logger.printable(content))
+
+    @staticmethod
+    def publish_rate(pub_id: str, published: int, rate: float) -> None:
+        Logger.log(Level.INFO, "RATE", Colors.PURPLE, "id({pub_id}) - published({published}) - rate({rate:.1f} msg/s)",
+                   pub_id=pub_id, published=published, rate=rate)
 
     @staticmethod
     def acknowledgement_pub(topic: str, message_id: int):
-        Logger.add_color(Colors.GREEN)
-        print(f"[ACK] t('{topic}') - msgid({message_id})")
-        Logger.reset_colors()
+        Logger.log(Level.INFO, "ACK", Colors.GREEN, "t('{topic}') - msgid({msg_id})", topic=topic, msg_id=message_id)
+
+
+Logger.configure_from_environment()
+# The records left are written before the program exits, and a forked child starts its own writer
+atexit.register(lambda: Logger.writer.stop())
+os.register_at_fork(after_in_child=Logger.restart_after_fork)
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import struct
+
+import zmq
+
+from ..excpt.unsupported_codec import UnsupportedCodec
+
+
+class BinaryParser:
+    """
+    Binary codec. Ids and types go in a fixed-width header frame, topics are utf-8
+    and contents are opaque bytes that are never decoded.
+    """
+
+    MAGIC = 0xB1  # Never the first byte of a text frame, so both codecs can share a socket
+    VERSION = 1
+    # magic, version, type and three integers whose meaning depends on the type
+    HEADER = struct.Struct('!BBBqqq')
+    # Values of a request beyond the three of the header, each one in a frame after the topic
+    EXTRA_VALUE = struct.Struct('!q')
+    TYPES = ["PUB", "GET", "ACK", "SUB", "UNSUB", "STREAM", "MSG", "FAULT", "MGET", "RUNS"]
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def is_binary(frame: bytes) -> bool:
+        return len(frame) > 0 and memoryview(frame)[0] == BinaryParser.MAGIC
+
+    @staticmethod
+    def pack(message_type: str, a: int = 0, b: int = 0, c: int = 0) -> bytes:
+        type_code = BinaryParser.TYPES.index(message_type) + 1
+        return BinaryParser.HEADER.pack(BinaryParser.MAGIC, BinaryParser.VERSION, type_code, a, b, c)
+
+    @staticmethod
+    def unpack(frame: bytes) -> tuple:
+        """
+        Returns the type and the three integers of a header
+        """
+        if len(frame) != BinaryParser.HEADER.size or not BinaryParser.is_binary(frame):
+            raise UnsupportedCodec("Not a binary header")
+        _, version, type_code, a, b, c = BinaryParser.HEADER.unpack(frame)
+        if version != BinaryParser.VERSION or not 0 < type_code <= len(BinaryParser.TYPES):
+            raise UnsupportedCodec(f"Unsupported binary header: version {version}, type {type_code}")
+        return BinaryParser.TYPES[type_code - 1], a, b, c
+
+    @staticmethod
+    def text(frame) -> str:
+        return bytes(frame).decode('utf-8')
+
+    @staticmethod
+    def content(content) -> bytes:
+        if isinstance(content, (bytes, memoryview, zmq.Frame)):
+            return content
+        return str(content).encode('utf-8')
+
+    # --------------------------------------------------------------------------
+    # Publications: [topic, header(PUB, pub_id, pub_msg_id), content]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def encode_publication(topic: str, pub_id, content, pub_msg_id: int) -> list:
+        # The topic stays the first frame, the subscriptions of the publishers filter by it
+        return [topic.encode('utf-8'), BinaryParser.pack("PUB", int(pub_id), pub_msg_id), BinaryParser.content(content)]
+
+    @staticmethod
+    def decode_publication(frames: list) -> tuple:
+        topic, header, content = frames
+        _, pub_id, pub_msg_id, _ = BinaryParser.unpack(header)
+        return BinaryParser.text(topic), pub_id, content, pub_msg_id
+
+    # --------------------------------------------------------------------------
+    # Requests of subscribers: [header(type, values...), topic, extra values...]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def encode_request(message_type: str, topic: str, *values) -> list:
+        frames = [BinaryParser.pack(message_type, *(int(value) for value in values[:3])), topic.encode('utf-8')]
+        frames.extend(BinaryParser.EXTRA_VALUE.pack(int(value)) for value in values[3:])
+        return frames
+
+    @staticmethod
+    def decode_request(frames: list) -> tuple:
+        header, topic, *extra = frames
+        message_type, a, b, c = BinaryParser.unpack(header)
+        values = [a, b, c]
+        for frame in extra:
+            if len(frame) != BinaryParser.EXTRA_VALUE.size:
+                raise UnsupportedCodec("Invalid value frame")
+            values.append(BinaryParser.EXTRA_VALUE.unpack(frame)[0])
+        return message_type, BinaryParser.text(topic), values
+
+    # --------------------------------------------------------------------------
+    # Messages to subscribers: [client_id, header(MSG, first_msg_id, count), topic, contents...]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def encode_messages(message: list) -> list:
+        client_id, topic, first_id, *contents = message
+        return [BinaryParser.encode_identity(client_id)] + BinaryParser.encode_shared_messages(topic, first_id, contents)
+
+    @staticmethod
+    def encode_identity(client_id) -> bytes:
+        return str(client_id).encode('utf-8')
+
+    @staticmethod
+    def encode_shared_messages(topic: str, first_id: int, contents: list) -> list:
+        """
+        Returns the frames after the identity, the same for every subscriber the messages are sent to
+        """
+        frames = [BinaryParser.pack("MSG", first_id, len(contents)), topic.encode('utf-8')]
+        frames.extend(BinaryParser.content(content) for content in contents)
+        return frames
+
+    @staticmethod
+    def decode_messages(frames: list) -> tuple:
+        header, topic, *contents = frames
+        _, first_id, _, _ = BinaryParser.unpack(header)
+        return BinaryParser.text(topic), first_id, contents
+
+    # --------------------------------------------------------------------------
+    # Multi-topic GET: [header(MGET, max_count, max_bytes, wait), topic, next_msg_id, topic, next_msg_id...]
+    # Its reply: [client_id, header(RUNS, runs), header(MSG, first_msg_id, count), topic, contents..., ...]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def is_multi_get(frames: list) -> bool:
+        # Only the type is read, the header is validated when it is decoded
+        header = frames[0]
+        return len(header) == BinaryParser.HEADER.size and BinaryParser.is_binary(header) and \
+            memoryview(header)[2] == BinaryParser.TYPES.index("MGET") + 1
+
+    @staticmethod
+    def encode_multi_get(requests: list, max_count: int, max_bytes: int, wait: int) -> list:
+        frames = [BinaryParser.pack("MGET", max_count, max_bytes, wait)]
+        for topic, next_msg_id in requests:
+            frames.extend((topic.encode('utf-8'), BinaryParser.EXTRA_VALUE.pack(next_msg_id)))
+        return frames
+
+    @staticmethod
+    def decode_multi_get(frames: list) -> tuple:
+        """
+        Returns the (topic, next message id) requested, and the budget and wait shared by them
+        """
+        header, *pairs = frames
+        _, max_count, max_bytes, wait = BinaryParser.unpack(header)
+        if len(pairs) % 2:
+            raise UnsupportedCodec("A topic of the multi-topic GET has no message id")
+
+        requests = []
+        for topic, next_msg_id in zip(pairs[::2], pairs[1::2]):
+            if len(next_msg_id) != BinaryParser.EXTRA_VALUE.size:
+                raise UnsupportedCodec("Invalid value frame")
+            requests.append((BinaryParser.text(topic), BinaryParser.EXTRA_VALUE.unpack(next_msg_id)[0]))
+        return requests, max_count, max_bytes, wait
+
+    @staticmethod
+    def encode_runs(client_id, runs: list) -> list:
+        """
+        Encodes in one reply the runs of messages of several topics, each as [client_id, topic, first_id, contents...]
+        """
+        frames = [BinaryParser.encode_identity(client_id), BinaryParser.pack("RUNS", len(runs))]
+        for _, topic, first_id, *contents in runs:
+            frames.extend(BinaryParser.encode_shared_messages(topic, first_id, contents))
+        return frames
+
+    @staticmethod
+    def decode_runs(frames: list) -> list:
+        """
+        Returns (topic, first_msg_id, contents) of every run of messages of a reply, of one or several topics
+        """
+        message_type, count, _, _ = BinaryParser.unpack(frames[0])
+        if message_type == "MSG":
+            return [BinaryParser.decode_messages(frames)]
+
+        runs = []
+        position = 1
+        for _ in range(count):
+            _, first_id, length, _ = BinaryParser.unpack(frames[position])
+            topic = BinaryParser.text(frames[position + 1])
+            runs.append((topic, first_id, frames[position + 2:position + 2 + length]))
+            position += 2 + length
+        return runs
+
+    # --------------------------------------------------------------------------
+    # Faults to publishers: [pub_id, header(FAULT, first, last), topic]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def encode_fault(pub_id, topic: str, first: int, last: int) -> list:
+        # The publisher id stays the first frame, the publishers subscribe to it
+        return [str(pub_id).encode('utf-8'), BinaryParser.pack("FAULT", first, last), topic.encode('utf-8')]
+
+    @staticmethod
+    def decode_fault(frames: list) -> tuple:
+        pub_id, header, topic = frames
+        _, first, last, _ = BinaryParser.unpack(header)
+        return BinaryParser.text(pub_id), BinaryParser.text(topic), first, last
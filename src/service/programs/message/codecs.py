@@ -0,0 +1,24 @@
+from .binary_parser import BinaryParser
+from .message_parser import MessageParser
+
+TEXT = "text"
+BINARY = "binary"
+
+# First id of the empty run that answers a request of a client not subscribed to the topic
+NOT_SUBSCRIBED = -1
+
+PARSERS = {
+    TEXT: MessageParser,
+    BINARY: BinaryParser,
+}
+
+
+def get_parser(codec: str):
+    return PARSERS[codec]
+
+
+def detect_codec(frame: bytes) -> str:
+    """
+    Returns the codec of a message, given the frame where a binary message has its header
+    """
+    return BINARY if BinaryParser.is_binary(frame) else TEXT
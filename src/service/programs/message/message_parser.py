@@ -1,4 +1,11 @@
+import zmq
+
+
 class MessageParser:
+    """
+    Text codec, every frame is an utf-8 string.
+    The contents of publications are kept as the frames they arrived in, only the subscribers decode them.
+    """
 
     def __init__(self):
         pass
@@ -6,11 +13,138 @@ class MessageParser:
     @staticmethod
     def encode(messages):
         for i in range(len(messages)):
-            messages[i] = str(messages[i]).encode('utf-8')
+            # Contents that are already bytes or frames are sent as they are
+            if not isinstance(messages[i], (bytes, memoryview, zmq.Frame)):
+                messages[i] = str(messages[i]).encode('utf-8')
         return messages
 
     @staticmethod
     def decode(messages):
         for i in range(len(messages)):
-            messages[i] = messages[i].decode('utf-8')
+            messages[i] = MessageParser.text(messages[i])
         return messages
+
+    @staticmethod
+    def text(frame) -> str:
+        # Received frames may be zmq.Frame objects, which are read through the buffer protocol
+        return bytes(frame).decode('utf-8')
+
+    # --------------------------------------------------------------------------
+    # Publications: [topic, pub_id, content, pub_msg_id]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def encode_publication(topic: str, pub_id, content, pub_msg_id: int) -> list:
+        return MessageParser.encode([topic, pub_id, content, pub_msg_id])
+
+    @staticmethod
+    def decode_publication(frames: list) -> tuple:
+        topic, pub_id, content, pub_msg_id = frames
+        return MessageParser.text(topic), int(pub_id), content, int(pub_msg_id)
+
+    # --------------------------------------------------------------------------
+    # Requests of subscribers: [type, topic, values...]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def encode_request(message_type: str, topic: str, *values) -> list:
+        return MessageParser.encode([message_type, topic, *values])
+
+    @staticmethod
+    def decode_request(frames: list) -> tuple:
+        message_type, topic, *values = MessageParser.decode(frames)
+        return message_type, topic, [int(value) for value in values]
+
+    # --------------------------------------------------------------------------
+    # Messages to subscribers: [client_id, topic, first_msg_id, contents...]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def encode_messages(message: list) -> list:
+        client_id, topic, first_id, *contents = message
+        return [MessageParser.encode_identity(client_id)] + MessageParser.encode_shared_messages(topic, first_id, contents)
+
+    @staticmethod
+    def encode_identity(client_id) -> bytes:
+        return str(client_id).encode('utf-8')
+
+    @staticmethod
+    def encode_shared_messages(topic: str, first_id: int, contents: list) -> list:
+        """
+        Returns the frames after the identity, the same for every subscriber the messages are sent to
+        """
+        return MessageParser.encode([topic, first_id, *contents])
+
+    @staticmethod
+    def decode_messages(frames: list) -> tuple:
+        topic, first_id, *contents = MessageParser.decode(frames)
+        return topic, int(first_id), contents
+
+    # --------------------------------------------------------------------------
+    # Multi-topic GET: [MGET, max_count, max_bytes, wait, topic, next_msg_id, topic, next_msg_id...]
+    # Its reply: [client_id, "", runs, topic, first_msg_id, count, contents..., topic, ...]
+    # The empty frame, never a topic, tells the reply apart from the messages of a single topic
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def is_multi_get(frames: list) -> bool:
+        return bytes(frames[0]) == b"MGET"
+
+    @staticmethod
+    def encode_multi_get(requests: list, max_count: int, max_bytes: int, wait: int) -> list:
+        frames = ["MGET", max_count, max_bytes, wait]
+        for topic, next_msg_id in requests:
+            frames.extend((topic, next_msg_id))
+        return MessageParser.encode(frames)
+
+    @staticmethod
+    def decode_multi_get(frames: list) -> tuple:
+        """
+        Returns the (topic, next message id) requested, and the budget and wait shared by them
+        """
+        _, max_count, max_bytes, wait, *pairs = MessageParser.decode(frames)
+        if len(pairs) % 2:
+            raise ValueError("A topic of the multi-topic GET has no message id")
+        requests = [(pairs[i], int(pairs[i + 1])) for i in range(0, len(pairs), 2)]
+        return requests, int(max_count), int(max_bytes), int(wait)
+
+    @staticmethod
+    def encode_runs(client_id, runs: list) -> list:
+        """
+        Encodes in one reply the runs of messages of several topics, each as [client_id, topic, first_id, contents...]
+        """
+        frames = [client_id, "", len(runs)]
+        for _, topic, first_id, *contents in runs:
+            frames.extend((topic, first_id, len(contents)))
+            frames.extend(contents)
+        return MessageParser.encode(frames)
+
+    @staticmethod
+    def decode_runs(frames: list) -> list:
+        """
+        Returns (topic, first_msg_id, contents) of every run of messages of a reply, of one or several topics
+        """
+        if len(frames[0]) > 0:
+            return [MessageParser.decode_messages(frames)]
+
+        frames = MessageParser.decode(frames)
+        runs = []
+        position = 2
+        for _ in range(int(frames[1])):
+            topic, first_id, count = frames[position], int(frames[position + 1]), int(frames[position + 2])
+            runs.append((topic, first_id, frames[position + 3:position + 3 + count]))
+            position += 3 + count
+        return runs
+
+    # --------------------------------------------------------------------------
+    # Faults to publishers: [pub_id, topic, first, last]
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def encode_fault(pub_id, topic: str, first: int, last: int) -> list:
+        return MessageParser.encode([pub_id, topic, first, last])
+
+    @staticmethod
+    def decode_fault(frames: list) -> tuple:
+        pub_id, topic, first, last = MessageParser.decode(frames)
+        return pub_id, topic, int(first), int(last)
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+
+
+class Histogram:
+    """
+    Distribution of durations in fixed buckets, so observing a value never allocates.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    # Upper bounds of the buckets in seconds, the last bucket has no bound
+    BOUNDS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    counts: list  # counts[<bucket>] = values observed in the bucket, not cumulative
+    total: float  # Sum of the values observed
+    count: int
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(Histogram.BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(Histogram.BOUNDS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        Returns (upper bound, values lower or equal to it) of every bucket, as Prometheus expects them
+        """
+        buckets = []
+        count = 0
+        for bound, bucket_count in zip((*Histogram.BOUNDS, float('inf')), self.counts):
+            count += bucket_count
+            buckets.append((bound, count))
+        return buckets
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import os
+import time
+
+from .histogram import Histogram
+
+
+class Metrics:
+    """
+    Counters and histograms updated in the hot path, and rendered in the Prometheus text format
+    together with gauges that are only computed when the metrics are read.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    prefix: str  # Prefix of the name of every metric
+    counters: dict  # counters[<name>] = value
+    histograms: dict  # histograms[<name>] = Histogram
+    started: float
+
+    def __init__(self, prefix: str = "broker") -> None:
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    # --------------------------------------------------------------------------
+    # Update data
+    # --------------------------------------------------------------------------
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    # --------------------------------------------------------------------------
+    # Rendering
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def labels(labels: dict) -> str:
+        if not labels:
+            return ""
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for value in labels.values())
+        return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+    def render(self, gauges: dict = None) -> str:
+        """
+        Returns every metric in the Prometheus text format.
+        gauges[<name>] = list of (labels, value), computed by the caller when the metrics are read
+        """
+        lines = [f"# TYPE {self.prefix}_uptime_seconds gauge",
+                 f"{self.prefix}_uptime_seconds {time.time() - self.started:.3f}"]
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {value}")
+
+        for name, samples in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"{self.prefix}_{name}{Metrics.labels(labels)} {value}")
+
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, count in histogram.cumulative():
+                bound = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"{metric}_sum {histogram.total:.6f}")
+            lines.append(f"{metric}_count {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str, gauges: dict = None) -> None:
+        """
+        Writes the metrics to a file, replacing it at once so a reader never sees half of them
+        """
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as f:
+            f.write(self.render(gauges))
+        os.replace(temporary_path, path)
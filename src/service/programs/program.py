@@ -16,7 +16,10 @@ class SocketCreationFunction(Enum):
 
 class Program(ABC):
     def __init__(self) -> None:
-        self.context = zmq.Context()
+        self.context = self.create_context()
+
+    def create_context(self) -> zmq.Context:
+        return zmq.Context()
 
     def create_socket(self, socket_type: zmq.TYPE, function: SocketCreationFunction, address: str) -> Socket | None:
         new_socket = self.context.socket(socket_type)
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import pickle
 import random
 import time
@@ -8,8 +10,10 @@ import zmq
 
 from .client import Client
 from .log.logger import Logger
-from .message.message_parser import MessageParser
+from .message.codecs import TEXT
+from .message.codecs import get_parser
 from .program import SocketCreationFunction
+from .state.retransmit_buffer import RetransmitBuffer
 
 
 class Publisher(Client):
@@ -23,13 +27,51 @@ class Publisher(Client):
     put_topic_dict: dict  # Last_topic_msg[topic] = message_id   # last message sent from each topic
     topic_names: list  # Possible topics
     n_topics: int  # Number of topics
+    codec: str  # Codec of the messages exchanged with the server
+    retransmit: RetransmitBuffer  # Last publications sent, resent when the server reports them as lost
+
+    # Rate
+    rate: float | None  # Target publications per second, None for unbounded
+    batch_size: int  # Publications sent between each check for faults
+    published: int  # Publications sent since the publisher started, without the ones resent
+    started: float  # Time the publisher started sending
+
+    # Checkpoint of put_topic_dict
+    checkpoint_messages: int  # Publications that trigger a checkpoint
+    checkpoint_interval: float  # Maximum seconds between checkpoints
+    last_checkpoint: float
+    published_at_checkpoint: int
 
     # --------------------------------------------------------------------------
     # Initialization of publisher
     # --------------------------------------------------------------------------
 
-    def __init__(self, messages_json: str, client_id: str) -> None:
+    def __init__(self, messages_json: str, client_id: str, codec: str = TEXT, rate: float | None = 0.5,
+                 batch_size: int = None, checkpoint_messages: int = 1000, checkpoint_interval: float = 1.0,
+                 retransmit_messages: int = 1000, retransmit_bytes: int = 1024 * 1024, spill_messages: int = 0) -> None:
         super().__init__(client_id)
+        self.codec = codec
+        self.parser = get_parser(codec)
+
+        # The publications evicted from memory are only spilled to disk if spill_messages is given
+        spill_directory = None
+        if spill_messages > 0:
+            current_path = os.path.dirname(__file__) + "/../../data/"
+            spill_directory = os.path.join(current_path, f"publisher_{client_id}_retransmit")
+        self.retransmit = RetransmitBuffer(retransmit_messages, retransmit_bytes, spill_directory, spill_messages)
+
+        # By default a batch takes about 10ms at the target rate
+        self.rate = rate
+        if batch_size is None:
+            batch_size = 100 if rate is None else max(1, int(rate / 100))
+        self.batch_size = batch_size
+        self.published = 0
+        self.started = time.monotonic()
+
+        self.checkpoint_messages = checkpoint_messages
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = self.started
+        self.published_at_checkpoint = 0
 
         self.put_topic_dict = {}
         self.get_state()
@@ -52,21 +94,53 @@ class Publisher(Client):
         f.close()
 
     def put(self, topic: str, msg_id: int, content: str) -> None:
-        self.publisher.send_multipart(MessageParser.encode([topic, self.id, content, msg_id]))
+        self.publisher.send_multipart(self.parser.encode_publication(topic, self.id, content, msg_id))
         Logger.put_message(self.id, topic, msg_id, content)
 
     def handle_fault(self):
-        try:
-            message = self.fault_server.recv_multipart(flags=zmq.NOBLOCK)
-        except zmq.Again as e:
-            return
-
+        """
+        Drains every fault message sent by the server and resends the ranges of lost messages
+        """
+        while True:
+            try:
+                message = self.fault_server.recv_multipart(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            self.resend(message)
+
+    def resend(self, message: list) -> None:
+        """
+        Resends the range of lost messages of a fault message
+        """
+        for topic, msg_id, content in self.lost_publications(message):
+            self.put(topic, msg_id, content)
+
+    def lost_publications(self, message: list) -> list:
+        """
+        Returns the (topic, msg_id, content) of the lost messages of a fault message that are still kept
+        """
         Logger.new_message(message)
-        _, topic, msg_id = MessageParser.decode(message)
-        content = self.messages[topic][int(msg_id) % len(self.messages[topic])]
-        self.put(topic, msg_id, content)
+        pub_id, topic, first, last = self.parser.decode_fault(message)
+        # The subscription is a prefix, so fault messages of other publishers may be received
+        if pub_id != self.id:
+            return []
+
+        publications = []
+        for msg_id in range(first, last + 1):
+            content = self.retransmit.get(topic, msg_id)
+            if content is None:
+                Logger.warning(f"The publication {msg_id} of '{topic}' is no longer kept, it can't be resent")
+                continue
+            publications.append((topic, msg_id, content))
+        return publications
 
     def publication(self):
+        self.put(*self.next_publication())
+
+    def next_publication(self) -> tuple:
+        """
+        Returns the (topic, msg_id, content) of the next publication, kept to be resent if it is lost
+        """
         # Get random topic
         topic = self.topic_names[random.randint(0, self.n_topics - 1)]
 
@@ -74,8 +148,32 @@ class Publisher(Client):
         msg_id = self.get_next_message(topic)
         content = self.messages[topic][msg_id % len(self.messages[topic])]
 
+        content = str(content).encode('utf-8')
         self.put_topic_dict[topic] = msg_id
-        self.put(topic, msg_id, str(content))
+        self.retransmit.add(topic, msg_id, content)
+        self.published += 1
+        return topic, msg_id, content
+
+    def publish_batch(self) -> None:
+        for _ in range(self.batch_size):
+            self.publication()
+
+    # -------------------------------------------------------------------------
+    # Rate Functions
+    # -------------------------------------------------------------------------
+
+    def pause(self) -> float:
+        """
+        Returns the seconds to wait before the next batch to keep the target rate
+        """
+        if self.rate is None:
+            return 0
+        # The schedule is kept from the start, so the time spent sending does not slow the rate down
+        return max(0.0, self.started + self.published / self.rate - time.monotonic())
+
+    def measured_rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.published / elapsed if elapsed > 0 else 0.0
 
     # -------------------------------------------------------------------------
     # State Functions
@@ -86,11 +184,24 @@ class Publisher(Client):
             return 0
         return self.put_topic_dict[topic] + 1
 
+    def checkpoint_due(self) -> bool:
+        return self.published - self.published_at_checkpoint >= self.checkpoint_messages or \
+            time.monotonic() - self.last_checkpoint >= self.checkpoint_interval
+
+    def mark_checkpoint(self) -> None:
+        self.last_checkpoint = time.monotonic()
+        self.published_at_checkpoint = self.published
+        Logger.publish_rate(self.id, self.published, self.measured_rate())
+
     def save_state(self) -> None:
+        self.mark_checkpoint()
+        self.write_state(self.put_topic_dict)
+
+    def write_state(self, put_topic_dict: dict) -> None:
         current_path = os.path.dirname(__file__) + "/../../data/"
         data_path = os.path.join(current_path, f"publisher_{self.id}.pkl")
         f = open(data_path, "wb+")
-        pickle.dump(self.put_topic_dict, f)
+        pickle.dump(put_topic_dict, f)
         f.close()
 
     def get_state(self) -> None:
@@ -106,17 +217,20 @@ class Publisher(Client):
     # --------------------------------------------------------------------------
 
     def run(self) -> None:
-
+        self.started = time.monotonic()
         while True:
             try:
-                # Send publication
-                self.publication()
+                # Send publications
+                self.publish_batch()
 
                 # Handles lost messages from the server.
                 self.handle_fault()
 
-                time.sleep(2)
-                self.save_state()
+                # The ids of the last publications are only saved once in a while, after a crash
+                # the publications not saved are sent again and the server drops them as duplicates
+                if self.checkpoint_due():
+                    self.save_state()
+                time.sleep(self.pause())
 
             except KeyboardInterrupt:
                 self.save_state()
@@ -1,12 +1,22 @@
 from __future__ import annotations
 
+import heapq
 import os
+import time
+
 import zmq
 
 from .log.logger import Logger
+from .excpt.unsupported_codec import UnsupportedCodec
+from .message.codecs import NOT_SUBSCRIBED
+from .message.codecs import detect_codec
+from .message.codecs import get_parser
 from .message.message_parser import MessageParser
+from .metrics.metrics import Metrics
 from .program import Program
 from .program import SocketCreationFunction
+from .state.retention import Retention
+from .state.retention import RetentionPolicy
 from .state.server_state import ServerState
 
 
@@ -21,62 +31,213 @@ class Server(Program):
     fault_pub: zmq.Socket
     router: zmq.Socket
     sync_sub:zmq.Socket
+    stats: zmq.Socket | None  # Requests of the metrics, None if they are not served
+    stats_address: str | None  # Address the stats socket binds, None to not serve the metrics
     state: ServerState
-    msg_counter: int
+    outbox: list  # (socket, frames) of the replies to send at the end of the wakeup
+    fairness_budget: int  # Maximum messages read from each socket per wakeup
+    commit_mutations: int  # Mutations that trigger a commit of the journal
+    commit_interval: float  # Maximum seconds a mutation waits to be committed
+    last_commit: float
+    retention: dict  # retention[<topic>] = Retention of the topic, retention[None] = Retention of the others
+    metrics: Metrics
+    metrics_file: str | None  # File where the metrics are dumped, None to not dump them
+    metrics_interval: float  # Seconds between each dump of the metrics
+    last_metrics_dump: float
+    get_deadlines: list  # Heap of (deadline, client id, topic) of the GETs waiting with a time limit
+    wait_deadlines: dict  # wait_deadlines[(<client id>, <topic>)] = deadline of the GET the client waits with
+    multi_waits: dict  # multi_waits[<client id>] = topics of the multi-topic GET the client waits with
+    rejected: dict  # rejected[<topic>] = publishers faulted once the topic has room for their rejected publications
 
     # --------------------------------------------------------------------------
     # Initialization of server
     # --------------------------------------------------------------------------
 
-    def __init__(self) -> None:
+    def __init__(self, fairness_budget: int = 100, commit_mutations: int = 100, commit_interval: float = 0.05,
+                 retention: dict = None, metrics_file: str = None, metrics_interval: float = 5.0,
+                 stats_address: str | None = '*:5550', data_file: str = "server_status.pkl") -> None:
         super().__init__()
+        self.stats = None
+        self.stats_address = stats_address
         self.init_sockets()
         self.create_poller()
+        self.outbox = []
+
+        self.fairness_budget = fairness_budget
+        # The journal is committed once enough mutations are pending or the oldest has waited too long.
+        self.commit_mutations = commit_mutations
+        self.commit_interval = commit_interval
+        self.last_commit = time.monotonic()
+
+        # Without a retention the messages are kept until every subscriber receives them
+        self.retention = retention or {}
+
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.last_metrics_dump = time.monotonic()
 
-        # How many messages must be received to the state be saved.
-        self.save_frequency = 5
-        # When this number achieves to 0, it saves the state in the file. It's decremented for each ACK.
-        self.msg_counter = self.save_frequency
+        self.get_deadlines = []
+        self.wait_deadlines = {}
+        self.multi_waits = {}
+        self.rejected = {}
 
         # State
         current_data_path = os.path.abspath(os.getcwd())
-        persistent_data_path = f"/data/server_status.pkl"
+        persistent_data_path = f"/data/{data_file}"
         data_path = current_data_path + persistent_data_path
         self.state = ServerState.read_state(data_path)
+        self.restore_subscriptions()
+        self.restore_waits()
+        self.restore_rejections()
 
     def init_sockets(self) -> None:
         self.backend = self.create_socket(zmq.XSUB, SocketCreationFunction.BIND, '*:5556')
         self.router = self.create_socket(zmq.ROUTER, SocketCreationFunction.BIND, '*:5554')
         self.fault_pub = self.create_socket(zmq.PUB, SocketCreationFunction.BIND, '*:5552')
         self.sync_sub = self.create_socket(zmq.ROUTER, SocketCreationFunction.BIND, '*:5553')
+        # A ROUTER answers the REQ sockets that ask for the metrics, and can be drained as the others
+        if self.stats_address is not None:
+            self.stats = self.create_socket(zmq.ROUTER, SocketCreationFunction.BIND, self.stats_address)
+
+    def restore_subscriptions(self) -> None:
+        """
+        Forwards to the publishers the topics that were subscribed before the server restarted
+        """
+        # Queued as the other replies, they are sent once the server runs
+        for topic in self.state.subscribed_topics():
+            self.reply(self.backend, [b'\x01' + topic.encode('utf-8')])
+
+    def restore_waits(self) -> None:
+        """
+        Gives the GETs that were waiting with a time limit before the server restarted a new deadline
+        """
+        for client_id, topic, wait in self.state.timed_waits():
+            self.wait_for(client_id, topic, wait)
+
+    def restore_rejections(self) -> None:
+        """
+        Faults again, once their topics have room, the publications that were missing before the server restarted
+        """
+        for pub_id, topic in self.state.missing_publishers():
+            self.rejected.setdefault(topic, set()).add(pub_id)
 
     def create_poller(self) -> None:
         self.poller = zmq.Poller()
         self.poller.register(self.backend, zmq.POLLIN)
         self.poller.register(self.router, zmq.POLLIN)
         self.poller.register(self.sync_sub, zmq.POLLIN)
+        if self.stats is not None:
+            self.poller.register(self.stats, zmq.POLLIN)
+
+    # --------------------------------------------------------------------------
+    #  Sending of messages
+    # --------------------------------------------------------------------------
+
+    def reply(self, socket: zmq.Socket, frames: list) -> None:
+        """
+        Queues a message, all of them are sent together once the ready sockets are drained
+        """
+        self.outbox.append((socket, frames))
+
+    def flush(self) -> None:
+        # The contents are the frames they were received in, they are sent without copying them
+        for socket, frames in self.outbox:
+            socket.send_multipart(frames, copy=False)
+        self.outbox = []
 
     # --------------------------------------------------------------------------
     #  Handling of messages
     # --------------------------------------------------------------------------
 
-    def update_pending_clients(self, topic: str) -> None:
+    def update_pending_clients(self, topic: str, message_id: int) -> None:
+        """
+        Sends the messages they are waiting for to the clients whose requested message is now in the topic,
+        the others keep waiting. The clients that need the same messages are grouped, so the messages are
+        read once per group.
+        """
+        for (requested, max_count, max_bytes), client_ids in self.state.wake_waiting_clients(topic, message_id).items():
+            message = self.state.messages_from(None, topic, requested, max_count, max_bytes)
+            if message is not None:
+                self.fan_out(client_ids, message)
+            else:
+                # The retention dropped the requested message and moved the clients past it
+                for client_id in client_ids:
+                    self.send_next_messages(client_id, topic, requested, max_count, max_bytes)
+
+            # A multi-topic GET is answered by the first of its topics that receives a message
+            if self.multi_waits:
+                for client_id in client_ids:
+                    self.cancel_multi_wait(client_id)
+
+    def send_next_messages(self, client_id: int, topic: str, requested: int, max_count: int, max_bytes: int) -> None:
+        """
+        Sends to a woken client the messages after the last one it received, an empty run if there are none
+        """
+        message = self.state.message_for_client(client_id, topic, None, max_count, max_bytes)
+        if message is None:
+            message = [client_id, topic, requested]
+        self.send_messages(message)
+        Logger.sent(client_id, topic, message[2], len(message) - 3)
+
+    def fan_out(self, client_ids: list, message: list) -> None:
         """
-        If there are any pending clients for a topic, goes through the list and sends the last received message
+        Sends the same messages to many subscribers. The frames after the identity are encoded once per codec
+        and sent to every subscriber of that codec without copying them.
         """
-        pending_clients = self.state.get_waiting_list(topic)
-        if not pending_clients:
+        _, topic, first_id, *contents = message
+        shared = {}  # shared[<codec>] = (parser, frames after the identity)
+        for client_id in client_ids:
+            codec = self.state.get_client_codec(client_id)
+            encoded = shared.get(codec)
+            if encoded is None:
+                parser = get_parser(codec)
+                frames = parser.encode_shared_messages(topic, first_id, contents)
+                if len(client_ids) > 1:
+                    frames = [frame if isinstance(frame, zmq.Frame) else zmq.Frame(frame) for frame in frames]
+                encoded = shared[codec] = (parser, frames)
+
+            parser, frames = encoded
+            self.reply(self.router, [parser.encode_identity(client_id), *frames])
+
+        self.metrics.increment('messages_sent', len(contents) * len(client_ids))
+        Logger.woken(topic, first_id, len(contents), client_ids)
+
+    def update_streams(self, topic: str) -> None:
+        """
+        Pushes the new messages of a topic to the streaming clients that still have credit
+        """
+        for client_id in self.state.get_streams(topic):
+            self.push_stream(client_id, topic)
+
+    def push_stream(self, client_id: int, topic: str) -> None:
+        message = self.state.message_for_stream(client_id, topic)
+        if message is None:
             return
 
-        Logger.success(f"      Send message to the waiting subscribers:", end=" ")
-        for client_id in pending_clients:
-            # Send message to pending client
-            message = self.state.message_for_client(client_id, topic)
-            self.router.send_multipart(MessageParser.encode(message))
-            Logger.success(client_id, end=" ")
+        first_id, count = message[2], len(message) - 3
+        self.send_messages(message)
+        Logger.sent(client_id, topic, first_id, count, pushed=True)
 
-        Logger.success()
-        self.state.empty_waiting_list(topic)
+    def send_messages(self, message: list) -> None:
+        """
+        Sends messages to a subscriber, in the codec the subscriber uses
+        """
+        parser = get_parser(self.state.get_client_codec(message[0]))
+        self.reply(self.router, parser.encode_messages(message))
+        self.metrics.increment('messages_sent', len(message) - 3)
+
+    def send_not_subscribed(self, client_id: int, topic: str) -> None:
+        """
+        Answers a client that is not subscribed to the topic, or no longer is, so it does not wait for a reply
+        """
+        self.send_messages([client_id, topic, NOT_SUBSCRIBED])
+        Logger.not_subscribed(client_id, topic)
+
+    def send_fault(self, pub_id: int, topic: str, first: int, last: int) -> None:
+        parser = get_parser(self.state.get_publisher_codec(pub_id))
+        self.reply(self.fault_pub, parser.encode_fault(pub_id, topic, first, last))
+        self.metrics.increment('faults_sent')
 
     def handle_pub_fault(self, pub_id: int, topic: str, pub_msg_id: int) -> bool:
         """
@@ -88,107 +249,394 @@ class Server(Program):
         # Check if the message is in the waiting list and remove if in waiting list.
         if pub_topic_state.is_waiting(pub_msg_id):
             # Remove from waiting list
-            pub_topic_state.remove_waiting(pub_msg_id)
+            self.state.remove_publisher_waiting(pub_id, topic, pub_msg_id)
             return True
         # Checks if duplicated.
         elif pub_msg_id <= pub_topic_state.last_msg:
+            self.metrics.increment('duplicated_publications')
             return False
 
         if pub_msg_id - pub_topic_state.last_msg > 1:
-            for lost_msg_id in range(pub_topic_state.last_msg + 1, pub_msg_id):
-                # Add to waiting set
-                pub_topic_state.add_waiting(lost_msg_id)
-                # Send fo message to the publisher.
-                self.fault_pub.send_multipart(MessageParser.encode([pub_id, topic, lost_msg_id]))
+            first_lost, last_lost = pub_topic_state.last_msg + 1, pub_msg_id - 1
+            # Add to waiting set
+            self.state.add_publisher_waiting(pub_id, topic, first_lost, last_lost)
+            # Send a single fault message with the range of lost messages to the publisher.
+            self.send_fault(pub_id, topic, first_lost, last_lost)
 
         # Update last message received from the publisher on the topic
-        pub_topic_state.last_msg = pub_msg_id
+        self.state.update_publisher_last_message(pub_id, topic, pub_msg_id)
         return True
 
-    def handle_publication(self) -> None:
+    def handle_publication(self, raw_message: list) -> None:
         """
-        Reads the message from the backend socket, creates a new id for it,
+        Handles a message from the backend socket, creates a new id for it,
         and adds the new message to the data structures
         """
-        raw_message = self.backend.recv_multipart()
         Logger.new_message(raw_message)
 
-        topic, pub_id, message, pub_msg_id = MessageParser.decode(raw_message)
+        # The codec of a publication is known by its second frame
+        codec = detect_codec(raw_message[1])
+        try:
+            topic, pub_id, message, pub_msg_id = get_parser(codec).decode_publication(raw_message)
+        except (UnsupportedCodec, ValueError) as e:
+            Logger.warning(f"      Invalid publication: {e}")
+            return
+        self.state.update_publisher_codec(pub_id, codec)
+
+        # A full topic rejects the publication before it is added, the publisher
+        # receives a fault for it once the topic has room and resends it
+        retention = self.retention_of(topic)
+        if retention is not None and retention.policy == RetentionPolicy.REJECT_PUBLISHER \
+                and self.state.is_topic_full(topic, retention, len(message)):
+            self.metrics.increment('rejected_publications')
+            Logger.rejected(pub_id, pub_msg_id, topic)
+            self.reject_publication(pub_id, topic, pub_msg_id)
+            return
 
         # Handle missing/duplicate publications
-        fault_message = self.handle_pub_fault(int(pub_id), topic, int(pub_msg_id))
+        fault_message = self.handle_pub_fault(pub_id, topic, pub_msg_id)
 
         if fault_message:
             message_id = self.state.add_message(topic, message)
+            self.metrics.increment('publications')
             Logger.publication(topic, message_id, message)
+            self.enforce_retention(topic)
+            # The retention may have evicted every subscriber, and removed the topic with them
+            if self.state.is_unsubscribed_topic(topic):
+                return
+            self.update_pending_clients(topic, message_id)
+            self.update_streams(topic)
+
+    def reject_publication(self, pub_id: int, topic: str, pub_msg_id: int) -> None:
+        """
+        Records a rejected publication as missing, as the ones lost before it
+        """
+        pub_topic_state = self.state.get_publish_dict(pub_id, topic)
+        if pub_msg_id > pub_topic_state.last_msg:
+            self.state.add_publisher_waiting(pub_id, topic, pub_topic_state.last_msg + 1, pub_msg_id)
+            self.state.update_publisher_last_message(pub_id, topic, pub_msg_id)
+        elif not pub_topic_state.is_waiting(pub_msg_id):
+            # Duplicated, the publication was already added
+            return
+        self.rejected.setdefault(topic, set()).add(pub_id)
 
-        self.update_pending_clients(topic)
+    def retry_rejected(self, topic: str) -> None:
+        """
+        Faults the publications rejected by a topic once it has room again. The ones that still
+        do not fit when they are resent are rejected again.
+        """
+        publishers = self.rejected.get(topic)
+        if publishers is None:
+            return
+        retention = self.retention_of(topic)
+        if retention is not None and self.state.is_topic_full(topic, retention, 0):
+            return
+
+        del self.rejected[topic]
+        for pub_id in publishers:
+            for first, last in self.state.missing_publications(pub_id, topic):
+                self.send_fault(pub_id, topic, first, last)
+
+    def retention_of(self, topic: str) -> Retention | None:
+        return self.retention.get(topic, self.retention.get(None))
+
+    def enforce_retention(self, topic: str) -> None:
+        """
+        Deletes the messages that exceed the retention of the topic, moving or evicting the subscribers
+        that did not receive them
+        """
+        retention = self.retention_of(topic)
+        if retention is None or retention.policy == RetentionPolicy.REJECT_PUBLISHER:
+            return
+        limit = self.state.retention_limit(topic, retention)
+        if limit is None:
+            return
+
+        if retention.policy == RetentionPolicy.EVICT_SUBSCRIBER:
+            for client_id in self.state.lagging_subscribers(topic, limit):
+                Logger.warning(f"      {client_id} was evicted from '{topic}', it lags behind the retention")
+                # A client blocked on the topic is told now, the others by the reply to their next request
+                blocked = self.state.is_sub_waiting(client_id, topic) or self.state.is_streaming(client_id, topic)
+                self.state.remove_subscriber(client_id, topic)
+                self.metrics.increment('evicted_subscribers')
+                if blocked:
+                    self.wait_deadlines.pop((client_id, topic), None)
+                    if self.multi_waits:
+                        self.cancel_multi_wait(client_id)
+                    self.send_not_subscribed(client_id, topic)
+            if self.state.is_unsubscribed_topic(topic):
+                self.reply(self.backend, [b'\x00' + topic.encode('utf-8')])
+                return
+
+        # The evictions may have collected some of the messages already
+        dropped = max(0, limit - self.state.first_message(topic) + 1)
+        advanced = self.state.drop_messages_until(topic, limit)
+        self.metrics.increment('dropped_messages', dropped)
+        self.metrics.increment('advanced_subscribers', len(advanced))
 
     def handle_acknowledgement(self, client_id: int, message_id: int, topic: str) -> None:
         Logger.acknowledgement(client_id, topic, message_id)
+        self.metrics.increment('acks')
 
         if self.state.check_client_subscription(client_id, topic) is not None:
             self.state.update_client_last_message(client_id, topic, message_id)
+            # The ACK gives credit back to a streaming client
+            if self.state.is_streaming(client_id, topic):
+                self.push_stream(client_id, topic)
+            if self.rejected:
+                self.retry_rejected(topic)
         else:
             Logger.warning(f"      {client_id} is not a subscriber of '{topic}'")
 
-    def handle_get(self, client_id: int, topic: str, msg_id: int) -> None:
+    def handle_get(self, client_id: int, topic: str, msg_id: int, max_count: int = 1, max_bytes: int = 0,
+                   wait: int = 0) -> None:
+        """
+        Sends the next messages to the client. If there are none, the GET waits for them at most wait
+        milliseconds, or until they arrive if the wait is 0.
+        """
         Logger.request(client_id, topic)
+        self.metrics.increment('gets')
 
         # Verify if client exists and is subscribed
         if self.state.check_client_subscription(client_id, topic) is None:
+            self.send_not_subscribed(client_id, topic)
             return
-        # Gets and verifies message
-        message = self.state.message_for_client(client_id, topic, msg_id)
+        # A new GET replaces the deadline of the previous one, and the multi-topic GET the client waited with
+        if self.wait_deadlines:
+            self.wait_deadlines.pop((client_id, topic), None)
+        if self.multi_waits:
+            self.cancel_multi_wait(client_id)
+        # Gets and verifies messages
+        message = self.state.message_for_client(client_id, topic, msg_id, max_count, max_bytes)
 
         if message is None:
             # Adds to the pending clients, as there's no message to be send
-            self.state.add_to_waiting_list(client_id, topic)
-            Logger.warning(f"      Added {client_id} to the waiting list for '{topic}'")
+            self.state.add_to_waiting_list(client_id, topic, max_count, max_bytes, wait)
+            if wait > 0:
+                self.wait_for(client_id, topic, wait)
+            Logger.waiting(client_id, topic)
+            return
+
+        first_id, count = message[2], len(message) - 3
+        self.send_messages(message)
+        Logger.sent(client_id, topic, first_id, count)
+
+    def handle_multi_get(self, client_id: int, requests: list, max_count: int, max_bytes: int, wait: int) -> None:
+        """
+        Sends in one reply the next messages of several topics, given as (topic, next message id), at most
+        max_count messages and max_bytes of content (0 for no limit) between all of them. If none of the topics
+        has messages, the client waits for the first one that receives them, as with a GET on each topic,
+        unless the wait is negative, then the reply has no runs.
+        """
+        Logger.multi_request(client_id, len(requests))
+        self.metrics.increment('multi_gets')
+        if self.multi_waits:
+            self.cancel_multi_wait(client_id)
+
+        topics, runs = [], []
+        remaining_count, remaining_bytes = max_count, max_bytes
+        for topic, msg_id in requests:
+            # The topics the client is not subscribed to are answered at once, it may have been evicted
+            if self.state.check_client_subscription(client_id, topic) is None:
+                runs.append([client_id, topic, NOT_SUBSCRIBED])
+                continue
+            topics.append(topic)
+            if self.wait_deadlines:
+                self.wait_deadlines.pop((client_id, topic), None)
+            if remaining_count <= 0:
+                continue
+
+            message = self.state.message_for_client(client_id, topic, msg_id, remaining_count, remaining_bytes)
+            if message is None:
+                continue
+            runs.append(message)
+            remaining_count -= len(message) - 3
+            if max_bytes:
+                remaining_bytes -= sum(len(content) for content in message[3:])
+                # The budget is spent, 0 would mean no limit
+                if remaining_bytes <= 0:
+                    remaining_count = 0
+
+        if runs or wait < 0:
+            parser = get_parser(self.state.get_client_codec(client_id))
+            self.reply(self.router, parser.encode_runs(client_id, runs))
+            self.metrics.increment('messages_sent', sum(len(message) - 3 for message in runs))
+            for _, topic, first_id, *contents in runs:
+                if contents:
+                    Logger.sent(client_id, topic, first_id, len(contents))
+            return
+
+        for topic in topics:
+            self.state.add_to_waiting_list(client_id, topic, max_count, max_bytes, wait)
+            if wait > 0:
+                self.wait_for(client_id, topic, wait)
+            Logger.waiting(client_id, topic)
+        if len(topics) > 1:
+            self.multi_waits[client_id] = topics
+
+    def cancel_multi_wait(self, client_id: int) -> None:
+        """
+        Removes from the waiting lists of its topics the multi-topic GET the client waits with, if any
+        """
+        topics = self.multi_waits.pop(client_id, None)
+        if topics is None:
             return
+        for topic in topics:
+            self.wait_deadlines.pop((client_id, topic), None)
+            if self.state.is_sub_waiting(client_id, topic):
+                self.state.cancel_wait(client_id, topic)
 
-        self.router.send_multipart(MessageParser.encode(message))
-        Logger.success(f"      The message {int(message[2])} was sent to the subscriber")
+    def wait_for(self, client_id: int, topic: str, wait: int) -> None:
+        deadline = time.monotonic() + wait / 1000
+        self.wait_deadlines[(client_id, topic)] = deadline
+        heapq.heappush(self.get_deadlines, (deadline, client_id, topic))
+
+    def expire_gets(self) -> None:
+        """
+        Answers the GETs whose wait expired with an empty run of messages, and removes them from the waiting list
+        """
+        now = time.monotonic()
+        while self.get_deadlines and self.get_deadlines[0][0] <= now:
+            deadline, client_id, topic = heapq.heappop(self.get_deadlines)
+            # The deadlines of the GETs already answered or replaced are skipped
+            if self.wait_deadlines.get((client_id, topic)) != deadline:
+                continue
+            del self.wait_deadlines[(client_id, topic)]
+            if not self.state.is_sub_waiting(client_id, topic):
+                continue
+
+            requested = self.state.cancel_wait(client_id, topic)
+            # The other topics of a multi-topic GET expire with this one, only one of them is answered
+            if self.multi_waits:
+                self.cancel_multi_wait(client_id)
+            self.send_messages([client_id, topic, requested])
+            self.metrics.increment('expired_gets')
+            Logger.expired(client_id, topic)
+
+    def handle_stream(self, client_id: int, topic: str, msg_id: int, window: int) -> None:
+        """
+        Starts pushing messages to the client with a credit of window messages, or stops if the window is 0
+        """
+        Logger.stream(client_id, topic, window)
+        self.metrics.increment('streams')
+
+        # Verify if client exists and is subscribed, only a request to open a stream waits for a reply
+        if self.state.check_client_subscription(client_id, topic) is None:
+            if window > 0:
+                self.send_not_subscribed(client_id, topic)
+            return
+
+        if window <= 0:
+            self.state.close_stream(client_id, topic)
+            return
+
+        self.state.next_message_of_client(client_id, topic, msg_id)
+        self.state.open_stream(client_id, topic, window)
+        self.push_stream(client_id, topic)
 
     def handle_subscription(self, client_id: int, topic: str) -> None:
         Logger.subscription(client_id, topic)
-        # Forward to publishers and add to data structure
-        subscribe_msg = b'\x01' + topic.encode('utf-8')
-        self.backend.send(subscribe_msg)
+        self.metrics.increment('subscriptions')
+        # Forward to publishers the first subscription of the topic and add to data structure
+        if self.state.is_unsubscribed_topic(topic):
+            subscribe_msg = b'\x01' + topic.encode('utf-8')
+            self.reply(self.backend, [subscribe_msg])
         self.state.add_subscriber(client_id, topic)
 
     def handle_unsubscription(self, client_id: int, topic: str) -> None:
         Logger.unsubscription(client_id, topic)
-        unsubscribe_msg = b'\x00' + topic.encode('utf-8')
-        self.backend.send(unsubscribe_msg)
-        self.state.remove_subscriber(client_id, topic)
+        self.metrics.increment('unsubscriptions')
+        if not self.state.is_subscribed(client_id, topic):
+            Logger.warning(f"      {client_id} is not a subscriber of '{topic}'")
+            return
 
-    def handle_sub_sync(self) -> None:
-        message = MessageParser.decode(self.sync_sub.recv_multipart())
+        self.state.remove_subscriber(client_id, topic)
+        # Forward to publishers once the topic has no subscribers left
+        if self.state.is_unsubscribed_topic(topic):
+            unsubscribe_msg = b'\x00' + topic.encode('utf-8')
+            self.reply(self.backend, [unsubscribe_msg])
+        elif self.rejected:
+            self.retry_rejected(topic)
+
+    def handle_sub_sync(self, raw_message: list) -> None:
+        message = MessageParser.decode(raw_message)
         client_id = int(message[0])
         topic = message[1]
 
         if self.state.is_sub_waiting(client_id, topic):
             Logger.sync(client_id, topic, True)
-            self.sync_sub.send_multipart(MessageParser.encode([client_id, "WAITING"]))
+            self.reply(self.sync_sub, MessageParser.encode([client_id, "WAITING"]))
         else:
             Logger.sync(client_id, topic, False)
-            self.sync_sub.send_multipart(MessageParser.encode([client_id, "NOT WAITING"]))
+            self.reply(self.sync_sub, MessageParser.encode([client_id, "NOT WAITING"]))
 
-    def handle_dealer(self) -> None:
-        message = MessageParser.decode(self.router.recv_multipart())
+    def handle_stats(self, raw_message: list) -> None:
+        """
+        Answers a request of the metrics, whatever it asks, with all of them in the Prometheus text format
+        """
+        identity = raw_message[0]
+        self.reply(self.stats, [identity, b'', self.metrics.render(self.gauges()).encode('utf-8')])
 
-        # Message parsing
-        client_id = int(message[0])
-        message_type = message[1]
-        topic = message[2]
-        if len(message) >= 4:
-            message_id = int(message[3])
+    def gauges(self) -> dict:
+        """
+        Returns the gauges of every topic, which are only computed when the metrics are read
+        """
+        gauges = {name: [] for name in ("topic_retained_messages", "topic_retained_bytes", "topic_backlog",
+                                        "topic_subscribers", "topic_waiting_clients", "topic_streams")}
+        for topic in self.state.topics():
+            labels = {"topic": topic}
+            gauges["topic_retained_messages"].append((labels, self.state.retained_messages(topic)))
+            gauges["topic_retained_bytes"].append((labels, self.state.retained_bytes(topic)))
+            gauges["topic_backlog"].append((labels, self.state.backlog(topic)))
+            gauges["topic_subscribers"].append((labels, self.state.subscriber_count(topic)))
+            gauges["topic_waiting_clients"].append((labels, self.state.waiting_count(topic)))
+            gauges["topic_streams"].append((labels, len(self.state.get_streams(topic))))
+        gauges["pending_mutations"] = [({}, self.state.pending_mutations())]
+        return gauges
+
+    def dump_metrics(self) -> None:
+        if self.metrics_file is None or time.monotonic() - self.last_metrics_dump < self.metrics_interval:
+            return
+        self.metrics.dump(self.metrics_file, self.gauges())
+        self.last_metrics_dump = time.monotonic()
+
+    def handle_dealer(self, raw_message: list) -> None:
+        # Message parsing, the codec is known by the frame after the identity
+        client_id = int(bytes(raw_message[0]))
+        codec = detect_codec(raw_message[1])
+        parser = get_parser(codec)
+        try:
+            if parser.is_multi_get(raw_message[1:]):
+                multi_get = parser.decode_multi_get(raw_message[1:])
+            else:
+                multi_get = None
+                message_type, topic, values = parser.decode_request(raw_message[1:])
+        except (UnsupportedCodec, ValueError) as e:
+            Logger.warning(f"      Invalid request from {client_id}: {e}")
+            return
+        self.state.update_client_codec(client_id, codec)
+
+        if multi_get is not None:
+            # As a batched GET, at least one message is sent
+            requests, max_count, max_bytes, wait = multi_get
+            self.handle_multi_get(client_id, requests, max(1, max_count), max_bytes, wait)
+            return
+
+        if len(values) >= 1:
+            message_id = values[0]
+        # Batched GET, with the maximum number of messages and bytes to receive
+        max_count, max_bytes = 1, 0
+        if len(values) >= 3:
+            max_count, max_bytes = max(1, values[1]), values[2]
+        # Long-poll GET, with the milliseconds it waits for messages, 0 to wait until they arrive
+        wait = values[3] if len(values) >= 4 else 0
 
         if message_type == "ACK":
             self.handle_acknowledgement(client_id, message_id, topic)
         elif message_type == "GET":
-            self.handle_get(client_id, topic, message_id)
+            self.handle_get(client_id, topic, message_id, max_count, max_bytes, wait)
+        elif message_type == "STREAM":
+            self.handle_stream(client_id, topic, message_id, values[1])
         elif message_type == "SUB":
             self.handle_subscription(client_id, topic)
         elif message_type == "UNSUB":
@@ -198,34 +646,86 @@ class Server(Program):
     # Main function of server
     # --------------------------------------------------------------------------
 
+    def drain(self, socket: zmq.Socket, handler) -> None:
+        """
+        Handles the messages already queued in the socket, up to the fairness budget.
+        The frames are received without copying them, only the headers are parsed.
+        """
+        for _ in range(self.fairness_budget):
+            try:
+                raw_message = socket.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            handler(raw_message)
+
+    def poll_timeout(self) -> float | None:
+        """
+        Returns how many milliseconds the poll can block before the pending mutations must be committed
+        or the next GET expires
+        """
+        deadlines = []
+        if self.state.pending_mutations() > 0:
+            deadlines.append(self.last_commit + self.commit_interval)
+        if self.get_deadlines:
+            deadlines.append(self.get_deadlines[0][0])
+        if not deadlines:
+            return None
+        return max(0.0, (min(deadlines) - time.monotonic()) * 1000)
+
+    def commit(self) -> None:
+        """
+        Commits the journal once enough mutations are pending or the oldest one waited long enough
+        """
+        pending = self.state.pending_mutations()
+        if pending == 0:
+            self.last_commit = time.monotonic()
+            return
+
+        if pending >= self.commit_mutations or time.monotonic() - self.last_commit >= self.commit_interval:
+            started = time.monotonic()
+            self.state.commit()
+            self.last_commit = time.monotonic()
+            self.metrics.observe('persistence', self.last_commit - started)
+            self.metrics.increment('commits')
+
     def run(self) -> None:
         """
         Runs the server, which includes handling subscriptions, publications,
         acknowledgements and error treatment
         """
+        # Forwards the subscriptions restored before the first wakeup
+        self.flush()
         while True:
             try:
-                socks = dict(self.poller.poll())
+                socks = dict(self.poller.poll(self.poll_timeout()))
+                woken = time.monotonic()
 
                 # Receives content from publishers
                 if socks.get(self.backend) == zmq.POLLIN:
-                    self.handle_publication()
+                    self.drain(self.backend, self.handle_publication)
 
                 # Receives message from subscribers
                 if socks.get(self.router) == zmq.POLLIN:
-                    self.handle_dealer()
+                    self.drain(self.router, self.handle_dealer)
 
                 # Receives synchronization requests from subscribers
                 if socks.get(self.sync_sub) == zmq.POLLIN:
-                    self.handle_sub_sync()
+                    self.drain(self.sync_sub, self.handle_sub_sync)
+
+                # Answers the requests of the metrics
+                if self.stats is not None and socks.get(self.stats) == zmq.POLLIN:
+                    self.drain(self.stats, self.handle_stats)
 
-                # Saves the state
-                if self.msg_counter == 0:
-                    self.msg_counter = self.save_frequency
-                    self.state.save_state()
+                # Answers the GETs that waited too long
+                self.expire_gets()
 
-                self.msg_counter -= 1
+                # Sends every reply of this wakeup and commits the mutations journaled
+                self.flush()
+                self.commit()
+                self.dump_metrics()
+                self.metrics.observe('poll_iteration', time.monotonic() - woken)
             except KeyboardInterrupt:
+                self.flush()
                 self.state.save_state()
                 Logger.err("Keyboard interrupt")
                 exit()
@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import multiprocessing
+import zlib
+from enum import Enum
+
+import zmq
+
+from .excpt.unsupported_codec import UnsupportedCodec
+from .log.logger import Logger
+from .message.codecs import detect_codec
+from .message.codecs import get_parser
+from .program import Program
+from .program import SocketCreationFunction
+from .server import Server
+
+
+class ShardPlane(Enum):
+    BACKEND = 0
+    ROUTER = 1
+    SYNC = 2
+    FAULT = 3
+
+
+def shard_port(base_port: int, index: int, plane: ShardPlane) -> int:
+    return base_port + len(ShardPlane) * index + plane.value
+
+
+def run_shard_worker(index: int, base_port: int, retention: dict) -> None:
+    ShardWorker(index, base_port, retention).run()
+
+
+class ShardWorker(Server):
+    """
+    Server that owns the topics of one shard. It receives from the front-end exactly what a
+    Server receives from its clients, so the handling of messages is the same.
+    """
+
+    index: int
+    base_port: int
+
+    def __init__(self, index: int, base_port: int, retention: dict = None) -> None:
+        self.index = index
+        self.base_port = base_port
+        # The workers do not serve the metrics, the front-end binds the ports of the broker
+        super().__init__(retention=retention, stats_address=None, data_file=f"server_status_shard{index}.pkl")
+
+    def init_sockets(self) -> None:
+        # The PAIR sockets keep the identity frames, so they behave as the sockets of a Server
+        self.backend = self.create_socket(zmq.PAIR, SocketCreationFunction.CONNECT, self.address(ShardPlane.BACKEND))
+        self.router = self.create_socket(zmq.PAIR, SocketCreationFunction.CONNECT, self.address(ShardPlane.ROUTER))
+        self.sync_sub = self.create_socket(zmq.PAIR, SocketCreationFunction.CONNECT, self.address(ShardPlane.SYNC))
+        self.fault_pub = self.create_socket(zmq.PUSH, SocketCreationFunction.CONNECT, self.address(ShardPlane.FAULT))
+
+    def address(self, plane: ShardPlane) -> str:
+        return f"localhost:{shard_port(self.base_port, self.index, plane)}"
+
+
+class PendingMultiGet:
+    """
+    Multi-topic GET split between the workers that own its topics, answered by the front-end in one reply.
+    The workers are first asked for the messages they have without waiting, and their runs are merged within
+    the budget of the request. Only if none has messages the workers wait, and the first that answers
+    answers the client.
+    """
+
+    identity: bytes
+    parser: object  # Parser of the codec of the client
+    order: dict  # order[<topic>] = position of the topic in the request
+    shard_requests: dict  # shard_requests[<shard index>] = (topic, next message id) of the topics of the worker
+    max_count: int
+    max_bytes: int
+    wait: int
+    polling: set  # Workers whose answer without waiting is awaited
+    runs: list  # (topic, first_msg_id, contents) answered by the workers
+
+    def __init__(self, identity: bytes, parser, order: dict, shard_requests: dict, max_count: int,
+                 max_bytes: int, wait: int) -> None:
+        self.identity = identity
+        self.parser = parser
+        self.order = order
+        self.shard_requests = shard_requests
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.wait = wait
+        self.polling = set()
+        self.runs = []
+
+    def reply(self) -> list:
+        """
+        Encodes the runs in the order of their topics in the request, within its budget. As in a Server,
+        the first message of a run is kept even if it exceeds the bytes left, and then the budget is spent.
+        """
+        runs = []
+        remaining_count, remaining_bytes = self.max_count, self.max_bytes
+        for topic, first_id, contents in sorted(self.runs, key=lambda run: self.order.get(run[0], 0)):
+            # The empty runs answer an expired wait or a topic the client is not subscribed to
+            if not contents:
+                runs.append([None, topic, first_id])
+                continue
+            if remaining_count <= 0:
+                continue
+
+            kept, size = [contents[0]], len(contents[0])
+            for content in contents[1:remaining_count]:
+                if self.max_bytes and size + len(content) > remaining_bytes:
+                    break
+                kept.append(content)
+                size += len(content)
+            runs.append([None, topic, first_id, *kept])
+
+            remaining_count -= len(kept)
+            if self.max_bytes:
+                remaining_bytes -= size
+                if remaining_bytes <= 0:
+                    remaining_count = 0
+        return self.parser.encode_runs(self.identity.decode('utf-8'), runs)
+
+
+class ShardedServer(Program):
+    """
+    Front-end of a broker whose topics are split between worker processes.
+    It binds the ports of a Server and forwards each message to the worker that owns its topic,
+    so publishers and subscribers use the same protocol. The metrics are not served, since they are
+    kept by each worker.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    # Sockets
+    poller: zmq.Poller
+    backend: zmq.Socket
+    fault_pub: zmq.Socket
+    router: zmq.Socket
+    sync_sub: zmq.Socket
+    shards: list  # shards[<index>][<ShardPlane>] = socket connected to the worker
+    routes: dict  # routes[<socket>] = function that forwards its messages
+    multi_gets: dict  # multi_gets[<client identity>] = PendingMultiGet not answered yet
+    outstanding: dict  # outstanding[<client identity>][<shard index>] = true if the worker may keep it waiting
+
+    n_shards: int
+    base_port: int
+    workers: list  # Processes running each ShardWorker
+    fairness_budget: int  # Maximum messages read from each socket per wakeup
+    retention: dict  # Retention of the topics, applied by the workers
+
+    # --------------------------------------------------------------------------
+    # Initialization of the front-end
+    # --------------------------------------------------------------------------
+
+    def __init__(self, n_shards: int, base_port: int = 5600, fairness_budget: int = 100,
+                 retention: dict = None) -> None:
+        super().__init__()
+        self.n_shards = n_shards
+        self.base_port = base_port
+        self.fairness_budget = fairness_budget
+        self.retention = retention
+        self.multi_gets = {}
+        self.outstanding = {}
+        self.init_sockets()
+        self.create_poller()
+        self.start_workers()
+
+    def init_sockets(self) -> None:
+        self.backend = self.create_socket(zmq.XSUB, SocketCreationFunction.BIND, '*:5556')
+        self.router = self.create_socket(zmq.ROUTER, SocketCreationFunction.BIND, '*:5554')
+        self.fault_pub = self.create_socket(zmq.PUB, SocketCreationFunction.BIND, '*:5552')
+        self.sync_sub = self.create_socket(zmq.ROUTER, SocketCreationFunction.BIND, '*:5553')
+
+        self.shards = []
+        for index in range(self.n_shards):
+            shard = {}
+            for plane in ShardPlane:
+                socket_type = zmq.PULL if plane == ShardPlane.FAULT else zmq.PAIR
+                address = f"*:{shard_port(self.base_port, index, plane)}"
+                shard[plane] = self.create_socket(socket_type, SocketCreationFunction.BIND, address)
+            self.shards.append(shard)
+
+    def create_poller(self) -> None:
+        self.routes = {
+            # Publications are forwarded by topic, the first frame
+            self.backend: lambda frames: self.shard_of(frames[0])[ShardPlane.BACKEND].send_multipart(frames, copy=False),
+            # Requests are forwarded by topic, the frame after the identity
+            self.router: self.forward_request,
+            self.sync_sub: lambda frames: self.shard_of(frames[1])[ShardPlane.SYNC].send_multipart(frames, copy=False),
+        }
+        for index, shard in enumerate(self.shards):
+            # Subscriptions, replies and faults of the workers go back through the front-end sockets
+            self.routes[shard[ShardPlane.BACKEND]] = lambda frames: self.backend.send_multipart(frames, copy=False)
+            self.routes[shard[ShardPlane.ROUTER]] = lambda frames, index=index: self.forward_reply(index, frames)
+            self.routes[shard[ShardPlane.SYNC]] = lambda frames: self.sync_sub.send_multipart(frames, copy=False)
+            self.routes[shard[ShardPlane.FAULT]] = lambda frames: self.fault_pub.send_multipart(frames, copy=False)
+
+        self.poller = zmq.Poller()
+        for socket in self.routes:
+            self.poller.register(socket, zmq.POLLIN)
+
+    def start_workers(self) -> None:
+        # Spawned processes do not inherit the context of the front-end
+        spawn = multiprocessing.get_context('spawn')
+        self.workers = []
+        for index in range(self.n_shards):
+            worker = spawn.Process(target=run_shard_worker, args=(index, self.base_port, self.retention), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    # --------------------------------------------------------------------------
+    # Forwarding of messages
+    # --------------------------------------------------------------------------
+
+    def shard_of(self, topic: zmq.Frame) -> dict:
+        return self.shards[self.shard_index(topic.bytes)]
+
+    def shard_index(self, topic: bytes) -> int:
+        """
+        Returns the index of the worker that owns the topic. The hash must not change between runs,
+        since each worker keeps the state of its topics.
+        """
+        return zlib.crc32(topic) % self.n_shards
+
+    def forward_request(self, frames: list) -> None:
+        """
+        Forwards a request to the worker that owns its topic. A multi-topic GET is split into one for each
+        worker with the topics it owns, and the front-end answers it with the runs of the workers.
+        """
+        parser = get_parser(detect_codec(frames[1]))
+        if not parser.is_multi_get(frames[1:]):
+            self.shard_of(frames[2])[ShardPlane.ROUTER].send_multipart(frames, copy=False)
+            return
+
+        try:
+            requests, max_count, max_bytes, wait = parser.decode_multi_get(frames[1:])
+        except (UnsupportedCodec, ValueError) as e:
+            Logger.warning(f"      Invalid request from {bytes(frames[0]).decode('utf-8', 'replace')}: {e}")
+            return
+
+        shard_requests = {}
+        for topic, next_msg_id in requests:
+            shard_requests.setdefault(self.shard_index(topic.encode('utf-8')), []).append((topic, next_msg_id))
+        order = {topic: position for position, (topic, _) in enumerate(requests)}
+        # A new multi-topic GET replaces the one of the client not answered yet
+        multi_get = PendingMultiGet(frames[0].bytes, parser, order, shard_requests, max(1, max_count),
+                                    max_bytes, wait)
+        self.multi_gets[multi_get.identity] = multi_get
+
+        # A worker that may keep a previous request waiting is not asked again, its answer is taken as
+        # the wait of this request. One answered at once is awaited as the answer of this request.
+        outstanding = self.outstanding.setdefault(multi_get.identity, {})
+        for index in shard_requests:
+            if index not in outstanding:
+                self.send_multi_get(multi_get, index, -1)
+            if not outstanding[index]:
+                multi_get.polling.add(index)
+
+    def send_multi_get(self, multi_get: PendingMultiGet, index: int, wait: int) -> None:
+        """
+        Sends to a worker the part of a multi-topic GET with its topics. A worker has at most one request
+        of each client at a time, so each answer it sends is known to belong to that request.
+        """
+        request = multi_get.parser.encode_multi_get(multi_get.shard_requests[index], multi_get.max_count,
+                                                    multi_get.max_bytes, wait)
+        self.shards[index][ShardPlane.ROUTER].send_multipart([multi_get.identity, *request], copy=False)
+        self.outstanding.setdefault(multi_get.identity, {})[index] = wait >= 0
+
+    def forward_reply(self, index: int, frames: list) -> None:
+        """
+        Forwards a reply of a worker to its client, unless it answers a part of a multi-topic GET.
+        Those are merged into the reply of the request, or dropped once the request is answered.
+        """
+        identity = frames[0].bytes
+        outstanding = self.outstanding.get(identity)
+        if outstanding is None or index not in outstanding:
+            self.router.send_multipart(frames, copy=False)
+            return
+        del outstanding[index]
+        if not outstanding:
+            del self.outstanding[identity]
+
+        multi_get = self.multi_gets.get(identity)
+        if multi_get is None:
+            return
+        multi_get.runs.extend(multi_get.parser.decode_runs(frames[1:]))
+        multi_get.polling.discard(index)
+        if multi_get.polling:
+            return
+
+        if multi_get.runs or multi_get.wait < 0:
+            del self.multi_gets[identity]
+            self.router.send_multipart(multi_get.reply(), copy=False)
+            return
+        # None of the workers has messages, all of them wait for the first that receives some
+        for index in multi_get.shard_requests:
+            if index not in self.outstanding.get(identity, {}):
+                self.send_multi_get(multi_get, index, multi_get.wait)
+
+    def drain(self, socket: zmq.Socket) -> None:
+        forward = self.routes[socket]
+        for _ in range(self.fairness_budget):
+            try:
+                frames = socket.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            forward(frames)
+
+    # --------------------------------------------------------------------------
+    # Main function of the front-end
+    # --------------------------------------------------------------------------
+
+    def run(self) -> None:
+        while True:
+            try:
+                for socket, _ in self.poller.poll():
+                    self.drain(socket)
+            except KeyboardInterrupt:
+                # The workers receive the interrupt as well and save their state
+                for worker in self.workers:
+                    worker.join()
+                Logger.err("Keyboard interrupt")
+                exit()
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+
+
+class IntervalSet:
+    """
+    Set of integers stored as sorted and disjoint ranges.
+    Its size depends on the number of ranges and not on the number of integers.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    starts: list  # First integer of each range
+    ends: list  # Last integer of each range, inclusive
+
+    def __init__(self) -> None:
+        self.starts = []
+        self.ends = []
+
+    # --------------------------------------------------------------------------
+    # Get data
+    # --------------------------------------------------------------------------
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+
+    def __len__(self) -> int:
+        return sum(end - start + 1 for start, end in zip(self.starts, self.ends))
+
+    def __bool__(self) -> bool:
+        return bool(self.starts)
+
+    def ranges(self) -> list:
+        return list(zip(self.starts, self.ends))
+
+    # --------------------------------------------------------------------------
+    # Update data
+    # --------------------------------------------------------------------------
+
+    def add(self, value: int) -> None:
+        self.add_range(value, value)
+
+    def add_range(self, first: int, last: int) -> None:
+        """
+        Adds every integer from first to last, merging the ranges it overlaps or touches
+        """
+        if first > last:
+            return
+
+        # Ranges that end right before first or later and start right after last or earlier
+        left = bisect_left(self.ends, first - 1)
+        right = bisect_right(self.starts, last + 1)
+
+        if left < right:
+            first = min(first, self.starts[left])
+            last = max(last, self.ends[right - 1])
+
+        self.starts[left:right] = [first]
+        self.ends[left:right] = [last]
+
+    def remove(self, value: int) -> None:
+        i = bisect_right(self.starts, value) - 1
+        if i < 0 or value > self.ends[i]:
+            raise KeyError(value)
+
+        start, end = self.starts[i], self.ends[i]
+        if start == end:
+            del self.starts[i]
+            del self.ends[i]
+        elif value == start:
+            self.starts[i] = value + 1
+        elif value == end:
+            self.ends[i] = value - 1
+        else:
+            # Splits the range in two
+            self.ends[i] = value - 1
+            self.starts.insert(i + 1, value + 1)
+            self.ends.insert(i + 1, end)
+
+    def __str__(self) -> str:
+        return str(self.ranges())
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import os
+import pickle
+import struct
+import zlib
+
+
+class Journal:
+    """
+    Segmented append-only log of the mutations applied to a state.
+    Records are buffered in memory and written to the active segment in group commits,
+    with a single fsync per commit. Once enough records were written the owner of the
+    journal should take a snapshot and drop the segments.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    RECORD_HEADER = struct.Struct('<II')  # length of the record, crc32 of the record
+    SEGMENT_SUFFIX = ".log"
+
+    directory: str
+    segment_size: int  # Bytes written to a segment before a new one is started
+    snapshot_records: int  # Records written before a snapshot is suggested
+    lsn: int  # Sequence number of the last record appended
+    pending: list  # Encoded records waiting for the next commit
+    records_since_snapshot: int
+
+    # --------------------------------------------------------------------------
+    # Initialization
+    # --------------------------------------------------------------------------
+
+    def __init__(self, directory: str, segment_size: int = 4 * 1024 * 1024, snapshot_records: int = 10000) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+        self.snapshot_records = snapshot_records
+        self.lsn = 0
+        self.pending = []
+        self.records_since_snapshot = 0
+        self.segment = None
+        self.segment_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self) -> list:
+        """
+        Returns the path of every segment, ordered by the first record they contain
+        """
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(Journal.SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    # --------------------------------------------------------------------------
+    # Writing
+    # --------------------------------------------------------------------------
+
+    def append(self, operation: str, *args) -> int:
+        """
+        Buffers a new record and returns its sequence number.
+        The record is only durable after the next commit.
+        """
+        self.lsn += 1
+        record = pickle.dumps((self.lsn, operation, args), protocol=pickle.HIGHEST_PROTOCOL)
+        self.pending.append(Journal.RECORD_HEADER.pack(len(record), zlib.crc32(record)))
+        self.pending.append(record)
+        return self.lsn
+
+    def commit(self) -> None:
+        """
+        Writes every pending record to the active segment and syncs it to disk
+        """
+        batch = self.detach()
+        if batch is not None:
+            self.write(batch)
+
+    def detach(self) -> tuple | None:
+        """
+        Takes the pending records as a batch (first sequence number, data) to be written,
+        so the writing can be done by another thread
+        """
+        if not self.pending:
+            return None
+
+        first_lsn = self.lsn - self.pending_records() + 1
+        self.records_since_snapshot += self.pending_records()
+        data = b''.join(self.pending)
+        self.pending = []
+        return first_lsn, data
+
+    def write(self, batch: tuple) -> None:
+        """
+        Writes a batch to the active segment and syncs it to disk
+        """
+        first_lsn, data = batch
+        if self.segment is None or self.segment_bytes >= self.segment_size:
+            self.open_segment(first_lsn)
+
+        self.segment.write(data)
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        self.segment_bytes += len(data)
+
+    def open_segment(self, first_lsn: int) -> None:
+        """
+        Closes the active segment and starts a new one named after its first record
+        """
+        self.close()
+        path = os.path.join(self.directory, f"{first_lsn:020d}{Journal.SEGMENT_SUFFIX}")
+        self.segment = open(path, 'wb')
+        self.segment_bytes = 0
+
+    def pending_records(self) -> int:
+        return len(self.pending) // 2
+
+    def needs_snapshot(self) -> bool:
+        return self.records_since_snapshot >= self.snapshot_records
+
+    def start_snapshot(self) -> int:
+        """
+        Returns the sequence number of the last record, which the snapshot being taken contains
+        """
+        self.records_since_snapshot = 0
+        return self.lsn
+
+    def remove_segments(self) -> None:
+        """
+        Deletes every segment. Must only be called once a snapshot containing
+        all the committed records is on disk.
+        """
+        self.close()
+        for path in self.segments():
+            os.remove(path)
+
+    def close(self) -> None:
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    # --------------------------------------------------------------------------
+    # Reading
+    # --------------------------------------------------------------------------
+
+    def replay(self, after_lsn: int = 0):
+        """
+        Yields (operation, args) for every committed record newer than after_lsn.
+        A torn record at the end of a segment ends the reading of that segment.
+        """
+        self.lsn = after_lsn
+        for path in self.segments():
+            for lsn, operation, args in Journal.read_segment(path):
+                self.records_since_snapshot += 1
+                if lsn <= after_lsn:
+                    continue
+                self.lsn = lsn
+                yield operation, args
+
+    @staticmethod
+    def read_segment(path: str):
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(Journal.RECORD_HEADER.size)
+                if len(header) < Journal.RECORD_HEADER.size:
+                    return
+                length, checksum = Journal.RECORD_HEADER.unpack(header)
+                record = f.read(length)
+                if len(record) < length or zlib.crc32(record) != checksum:
+                    return
+                yield pickle.loads(record)
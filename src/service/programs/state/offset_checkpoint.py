@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import os
+import struct
+import zlib
+
+
+class OffsetCheckpoint:
+    """
+    File of fixed-size slots, each one keeping an integer that is overwritten in place.
+    Every slot has two records written alternately, so a torn write never loses the previous value.
+    Writes reach the file immediately, but only a sync makes them durable.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    RECORD = struct.Struct('<qqI')  # sequence, value, crc32 of the sequence and the value
+
+    path: str
+    slots: int
+    fd: int | None
+    sequence: int  # Sequence of the last record written
+    latest: list  # latest[<slot>] = record of the slot with the last value, 0 or 1
+
+    def __init__(self, path: str, slots: int) -> None:
+        self.path = path
+        self.slots = slots
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        records = self.records()
+        self.sequence = max((record[0] for record in records if record is not None), default=0)
+        self.latest = [self.latest_record(records[2 * slot:2 * slot + 2]) for slot in range(slots)]
+
+    # --------------------------------------------------------------------------
+    # Reading
+    # --------------------------------------------------------------------------
+
+    def records(self) -> list:
+        """
+        Returns every valid record of the file as (sequence, value), None for the invalid ones
+        """
+        data = os.pread(self.fd, 2 * self.slots * OffsetCheckpoint.RECORD.size, 0)
+        records = []
+        for position in range(0, 2 * self.slots * OffsetCheckpoint.RECORD.size, OffsetCheckpoint.RECORD.size):
+            record = data[position:position + OffsetCheckpoint.RECORD.size]
+            if len(record) < OffsetCheckpoint.RECORD.size:
+                records.append(None)
+                continue
+            sequence, value, crc = OffsetCheckpoint.RECORD.unpack(record)
+            valid = sequence > 0 and crc == zlib.crc32(record[:-4])
+            records.append((sequence, value) if valid else None)
+        return records
+
+    @staticmethod
+    def latest_record(records: list) -> int:
+        """
+        Returns which of the two records of a slot has the highest sequence, 1 if none of them is valid
+        """
+        first, second = records
+        if first is not None and (second is None or first[0] > second[0]):
+            return 0
+        return 1
+
+    def read(self, slot: int) -> int | None:
+        """
+        Returns the last value written to the slot, None if it was never written
+        """
+        record = self.records()[2 * slot + self.latest[slot]]
+        if record is None:
+            return None
+        return record[1]
+
+    # --------------------------------------------------------------------------
+    # Writing
+    # --------------------------------------------------------------------------
+
+    def write(self, slot: int, value: int) -> None:
+        self.sequence += 1
+        data = struct.pack('<qq', self.sequence, value)
+        record = data + struct.pack('<I', zlib.crc32(data))
+
+        # Overwrites the older record, the last value is kept if the write is torn
+        index = 1 - self.latest[slot]
+        os.pwrite(self.fd, record, (2 * slot + index) * OffsetCheckpoint.RECORD.size)
+        self.latest[slot] = index
+
+    def sync(self) -> None:
+        os.fsync(self.fd)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def delete(self) -> None:
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import heapq
+
+
+class OffsetIndex:
+    """
+    Multiset of the positions of the subscribers of a topic.
+    Keeps the lowest position available without going through the subscribers.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    counts: dict  # counts[<offset>] = number of subscribers in that offset
+    heap: list  # Offsets of counts, it may keep offsets that were already removed
+
+    def __init__(self) -> None:
+        self.counts = {}
+        self.heap = []
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    # --------------------------------------------------------------------------
+    # Get data
+    # --------------------------------------------------------------------------
+
+    def minimum(self) -> int | float:
+        """
+        Returns the lowest offset, infinity if there are no subscribers
+        """
+        # Removed offsets are only dropped once they reach the top of the heap
+        while self.heap and self.heap[0] not in self.counts:
+            heapq.heappop(self.heap)
+
+        if not self.heap:
+            return float('inf')
+        return self.heap[0]
+
+    # --------------------------------------------------------------------------
+    # Update data
+    # --------------------------------------------------------------------------
+
+    def add(self, offset: int) -> None:
+        if offset in self.counts:
+            self.counts[offset] += 1
+            return
+
+        self.counts[offset] = 1
+        heapq.heappush(self.heap, offset)
+
+        # Rebuilds the heap when most of it is made of removed offsets
+        if len(self.heap) > 2 * len(self.counts) + 64:
+            self.heap = list(self.counts)
+            heapq.heapify(self.heap)
+
+    def remove(self, offset: int) -> None:
+        self.counts[offset] -= 1
+        if self.counts[offset] == 0:
+            self.counts.pop(offset)
+
+    def move(self, old_offset: int, new_offset: int) -> None:
+        if old_offset == new_offset:
+            return
+        self.remove(old_offset)
+        self.add(new_offset)
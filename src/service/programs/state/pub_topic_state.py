@@ -1,14 +1,20 @@
+from .interval_set import IntervalSet
+
+
 class PubTopicState:
 
     def __init__(self):
         self.last_msg = -1
-        self.waiting_messages = []
+        self.waiting_messages = IntervalSet()
 
     def remove_waiting(self, msg_id: int):
         self.waiting_messages.remove(msg_id)
 
     def add_waiting(self, msg_id: int):
-        self.waiting_messages.append(msg_id)
+        self.waiting_messages.add(msg_id)
+
+    def add_waiting_range(self, first: int, last: int):
+        self.waiting_messages.add_range(first, last)
 
     def is_waiting(self, msg_id: int):
         if msg_id in self.waiting_messages:
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import os
+from enum import Enum
+
+from .topic_log import TopicLog
+
+
+class RetentionPolicy(Enum):
+    DROP_OLDEST = "drop"  # Drops the oldest messages, moving the lagging subscribers past them
+    REJECT_PUBLISHER = "reject"  # Rejects the publications, the publishers resend them after a fault
+    EVICT_SUBSCRIBER = "evict"  # Unsubscribes the subscribers that lag behind the limits
+
+
+class Retention:
+    """
+    Limits of the messages retained for a topic, and the policy applied when they are exceeded.
+    A limit of 0 means no limit.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    max_messages: int
+    max_bytes: int
+    max_age: float  # Seconds a message is retained
+    policy: RetentionPolicy
+
+    def __init__(self, max_messages: int = 0, max_bytes: int = 0, max_age: float = 0,
+                 policy: RetentionPolicy = RetentionPolicy.DROP_OLDEST) -> None:
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.policy = policy
+
+    @staticmethod
+    def from_environment() -> dict | None:
+        """
+        Returns the retention of every topic given by RETENTION_MAX_MESSAGES, RETENTION_MAX_BYTES,
+        RETENTION_MAX_AGE and RETENTION_POLICY, None if none of them is set. Raises ValueError if one is invalid.
+        """
+        names = ("RETENTION_MAX_MESSAGES", "RETENTION_MAX_BYTES", "RETENTION_MAX_AGE", "RETENTION_POLICY")
+        if not any(name in os.environ for name in names):
+            return None
+
+        max_messages = int(os.environ.get("RETENTION_MAX_MESSAGES", 0))
+        max_bytes = int(os.environ.get("RETENTION_MAX_BYTES", 0))
+        max_age = float(os.environ.get("RETENTION_MAX_AGE", 0))
+        policy = RetentionPolicy(os.environ.get("RETENTION_POLICY", RetentionPolicy.DROP_OLDEST.value))
+        # nan is not greater or equal than 0
+        if max_messages < 0 or max_bytes < 0 or not max_age >= 0:
+            raise ValueError("the limits of the retention can not be negative")
+        return {None: Retention(max_messages, max_bytes, max_age, policy)}
+
+    # --------------------------------------------------------------------------
+    # Limits
+    # --------------------------------------------------------------------------
+
+    def is_full(self, topic_log: TopicLog, size: int, now: float) -> bool:
+        """
+        Returns true if a message of the given size can not be added without exceeding the limits
+        """
+        if self.max_messages and len(topic_log) + 1 > self.max_messages:
+            return True
+        if self.max_bytes and topic_log.retained_bytes + size > self.max_bytes:
+            return True
+        return bool(self.max_age) and len(topic_log) > 0 and \
+            topic_log.timestamp(topic_log.first()) < now - self.max_age
+
+    def first_to_keep(self, topic_log: TopicLog, now: float) -> int:
+        """
+        Returns the id of the oldest message that can be retained without exceeding the limits.
+        The last message is always retained, even if it exceeds them by itself.
+        """
+        last = topic_log.next_offset - 1
+        first = topic_log.base_offset
+        if self.max_messages:
+            first = max(first, topic_log.next_offset - self.max_messages)
+
+        if self.max_bytes:
+            retained_bytes = topic_log.retained_bytes
+            for msg_id in range(topic_log.base_offset, first):
+                retained_bytes -= topic_log.size(msg_id)
+            while first < last and retained_bytes > self.max_bytes:
+                retained_bytes -= topic_log.size(first)
+                first += 1
+
+        if self.max_age:
+            while first < last and topic_log.timestamp(first) < now - self.max_age:
+                first += 1
+
+        return first
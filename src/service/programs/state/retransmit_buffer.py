@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import os
+import shutil
+
+from .topic_log import TopicLog
+
+
+class RetransmitBuffer:
+    """
+    Last publications sent of each topic, kept to resend the ones the server reports as lost.
+    The ids of a topic are sequential, so the publications are found and evicted without a search.
+    Each topic keeps at most max_messages and max_bytes in memory, the evicted publications are
+    spilled to disk if a spill directory is given, up to spill_messages of them.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    max_messages: int
+    max_bytes: int
+    spill_directory: str | None
+    spill_messages: int
+    recent: dict  # recent[<topic>][<msg_id>] = content of the publication
+    first_ids: dict  # first_ids[<topic>] = id of the oldest publication in memory
+    sizes: dict  # sizes[<topic>] = bytes of the publications in memory
+    spilled: dict  # spilled[<topic>] = TopicLog with the publications evicted from memory
+
+    def __init__(self, max_messages: int = 1000, max_bytes: int = 1024 * 1024, spill_directory: str = None,
+                 spill_messages: int = 100000) -> None:
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.spill_directory = spill_directory
+        self.spill_messages = spill_messages
+        self.recent = {}
+        self.first_ids = {}
+        self.sizes = {}
+        self.spilled = {}
+
+        # The spilled publications are not recovered after a restart
+        if spill_directory is not None and os.path.exists(spill_directory):
+            shutil.rmtree(spill_directory)
+
+    # --------------------------------------------------------------------------
+    # Get data
+    # --------------------------------------------------------------------------
+
+    def get(self, topic: str, msg_id: int):
+        """
+        Returns the content of a publication, None if it is no longer kept
+        """
+        content = self.recent.get(topic, {}).get(msg_id)
+        if content is None and topic in self.spilled:
+            content = self.spilled[topic].get(msg_id)
+        return content
+
+    # --------------------------------------------------------------------------
+    # Update data
+    # --------------------------------------------------------------------------
+
+    def add(self, topic: str, msg_id: int, content: bytes) -> None:
+        recent = self.recent.setdefault(topic, {})
+        if not recent:
+            self.first_ids[topic] = msg_id
+            self.sizes[topic] = 0
+        recent[msg_id] = content
+        self.sizes[topic] += len(content)
+
+        # The last publication is kept even if it is bigger than the limit
+        while len(recent) > 1 and (len(recent) > self.max_messages or self.sizes[topic] > self.max_bytes):
+            self.evict(topic)
+
+    def evict(self, topic: str) -> None:
+        first_id = self.first_ids[topic]
+        content = self.recent[topic].pop(first_id)
+        self.first_ids[topic] = first_id + 1
+        self.sizes[topic] -= len(content)
+
+        if self.spill_directory is not None:
+            self.spill(topic, first_id, content)
+
+    def spill(self, topic: str, msg_id: int, content: bytes) -> None:
+        # The publications are evicted in the order of their ids, so they are appended in that order
+        spilled = self.spilled.get(topic)
+        if spilled is None:
+            directory = os.path.join(self.spill_directory, topic.encode('utf-8').hex())
+            spilled = self.spilled[topic] = TopicLog(directory, first_id=msg_id)
+
+        spilled.append(content)
+        # The spilled publications are not recovered after a restart, so their segments are never flushed
+        spilled.take_unflushed()
+        if len(spilled) > self.spill_messages:
+            self.remove_segments(spilled.truncate_until(spilled.next_offset - self.spill_messages - 1))
+
+    @staticmethod
+    def remove_segments(segments: list) -> None:
+        for segment in segments:
+            segment.remove()
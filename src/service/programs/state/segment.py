@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import mmap
+import os
+
+
+class Segment:
+    """
+    Fixed-size file where the contents of consecutive messages of a topic are appended.
+    The file is memory-mapped, so reading a message does not load the rest of the segment.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    SUFFIX = ".seg"
+
+    path: str
+    first_id: int  # Id of the first message written to the segment
+    size: int  # Bytes reserved for the file
+    map: mmap.mmap | None  # Mapping of the file, only open while the segment is used
+
+    def __init__(self, directory: str, first_id: int, size: int, generation: int = 0) -> None:
+        self.path = os.path.join(directory, f"{generation:010d}-{first_id:020d}{Segment.SUFFIX}")
+        self.first_id = first_id
+        self.size = size
+        self.map = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['map'] = None
+        return state
+
+    def open(self) -> mmap.mmap:
+        """
+        Maps the file, creating it if it does not exist
+        """
+        if self.map is None:
+            with open(self.path, 'a+b') as f:
+                if os.fstat(f.fileno()).st_size < self.size:
+                    f.truncate(self.size)
+                self.map = mmap.mmap(f.fileno(), self.size)
+        return self.map
+
+    # --------------------------------------------------------------------------
+    # Reading and writing
+    # --------------------------------------------------------------------------
+
+    def read(self, position: int, length: int) -> memoryview:
+        """
+        Returns a view of the content, which keeps the mapping alive until it is released
+        """
+        return memoryview(self.open())[position:position + length]
+
+    def write(self, position: int, content) -> None:
+        self.open()[position:position + len(content)] = content
+
+    def flush(self) -> None:
+        if self.map is not None:
+            self.map.flush()
+
+    def remove(self) -> None:
+        # The views still being sent keep the pages mapped until they are released
+        self.map = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,9 +1,18 @@
 from __future__ import annotations
 
 import json
+import os
+import time
 
+from ..log.logger import Logger
+from ..message.codecs import TEXT
+from .journal import Journal
+from .offset_index import OffsetIndex
 from .pub_topic_state import PubTopicState
+from .retention import Retention
 from .state import State
+from .topic_log import TopicLog
+from .waiting_index import WaitingIndex
 
 
 class ServerState(State):
@@ -11,23 +20,109 @@ class ServerState(State):
     # Initialization
     # --------------------------------------------------------------------------
 
-    topic_dict: dict  # topic_dict[<topic>][<message id>] = message
+    topic_dict: dict  # topic_dict[<topic>] = TopicLog of the retained messages
     client_dict: dict  # client_dict[<client id>][<topic>] = last message received
-    pending_clients: dict  # pending_clients[<topic>] = list of clients waiting
+    pending_clients: dict  # pending_clients[<topic>] = WaitingIndex of the clients waiting for each message
+    waiting_clients: dict  # waiting_clients[<topic>][<client id>] = (requested message, max messages, max bytes, wait)
+    streams: dict  # streams[<topic>][<client id>] = [credit window, last message pushed]
     publish_dict: dict  # publish_fail[<publisher>][<topic>] = PubTopicState
+    client_codecs: dict  # client_codecs[<client id>] = codec of the messages sent to the client
+    publisher_codecs: dict  # publisher_codecs[<publisher>] = codec of the faults sent to the publisher
+    topic_subscribers: dict  # topic_subscribers[<topic>] = set of clients subscribed
+    watermarks: dict  # watermarks[<topic>] = OffsetIndex with the last message received by each subscriber
+    journal: Journal | None  # Mutations applied since the last snapshot
+    dropped_segments: list  # Segments without retained messages, removed once the journal is committed
+    topic_logs_created: int  # Generation of the next TopicLog, the files of a removed topic may not be removed yet
+    snapshot_lsn: int  # Last journal record contained in the snapshot
 
     def __init__(self, data_path: str) -> None:
         super().__init__(data_path)
         self.topic_dict = {}
         self.client_dict = {}
         self.pending_clients = {}
+        self.waiting_clients = {}
+        self.streams = {}
         self.publish_dict = {}
+        self.client_codecs = {}
+        self.publisher_codecs = {}
+        self.topic_subscribers = {}
+        self.watermarks = {}
+        self.journal = None
+        self.dropped_segments = []
+        self.topic_logs_created = 0
+        self.snapshot_lsn = 0
 
     @staticmethod
     def read_state(data_path: str):
         state = State.get_state_from_file(data_path)
         if state is None:
-            return ServerState(data_path)
+            state = ServerState(data_path)
+        state.open_journal()
+        return state
+
+    def open_journal(self) -> None:
+        """
+        Replays the mutations journaled after the snapshot and starts journaling new ones
+        """
+        journal = Journal(os.path.splitext(self.data_path)[0] + "_journal")
+        for operation, args in journal.replay(self.snapshot_lsn):
+            getattr(self, operation)(*args)
+        self.journal = journal
+
+        # The messages pushed but not acknowledged before the restart are pushed again
+        for topic, topic_streams in self.streams.items():
+            for client_id, stream in topic_streams.items():
+                stream[1] = self.client_dict[client_id][topic]
+
+    def log(self, operation: str, *args) -> None:
+        """
+        Journals a mutation. Nothing is journaled while replaying.
+        """
+        if self.journal is not None:
+            self.journal.append(operation, *args)
+
+    def pending_mutations(self) -> int:
+        return self.journal.pending_records()
+
+    def commit(self) -> None:
+        """
+        Makes the journaled mutations durable, compacting the journal into a snapshot when it grows too much
+        """
+        self.write_commit(*self.prepare_commit())
+
+    def save_state(self) -> None:
+        self.write_commit(*self.prepare_commit(snapshot=True))
+
+    def prepare_commit(self, snapshot: bool = False) -> tuple:
+        """
+        Takes the pending mutations, and a snapshot if one is due, so that write_commit
+        can run in another thread while the state keeps changing
+        """
+        batch = self.journal.detach()
+        dropped, self.dropped_segments = self.dropped_segments, []
+        if not snapshot and not self.journal.needs_snapshot():
+            return batch, dropped, [], None
+
+        self.snapshot_lsn = self.journal.start_snapshot()
+        unflushed = [segment for topic_log in self.topic_dict.values() for segment in topic_log.take_unflushed()]
+        return batch, dropped, unflushed, self.serialize()
+
+    def write_commit(self, batch: tuple | None, dropped: list, unflushed: list, snapshot: bytes | None) -> None:
+        if batch is not None:
+            self.journal.write(batch)
+        # The files of the segments are only removed once the truncation that dropped them is durable
+        for segment in dropped:
+            segment.remove()
+        if snapshot is not None:
+            # The snapshot replaces the journal, which is the only other copy of the messages
+            for segment in unflushed:
+                segment.flush()
+            self.write_state(snapshot, sync=True)
+            self.journal.remove_segments()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['journal'] = None
         return state
 
     # --------------------------------------------------------------------------
@@ -39,9 +134,7 @@ class ServerState(State):
         Returns the id of the last message of the topic that was received
         from a publisher
         """
-        if len(self.topic_dict[topic]) == 0:
-            return -1
-        return list(self.topic_dict[topic].keys())[-1]
+        return self.topic_dict[topic].last()
 
     def check_client_subscription(self, client_id: int, topic: str) -> int | None:
         """
@@ -51,63 +144,171 @@ class ServerState(State):
         position = self.client_dict.get(client_id, {}).get(topic)
         return position
 
-    def message_for_client(self, client_id: int, topic: str, msg_id: int = None) -> list:
+    def message_for_client(self, client_id: int, topic: str, msg_id: int = None, max_count: int = 1,
+                           max_bytes: int = 0) -> list:
         """
-        Returns the next message that needs to be send to the client,
-        in the following format: [client_id, topic, msg_id, msg_content]
+        Returns the next contiguous messages that need to be send to the client, at most max_count of them
+        and at most max_bytes of content (0 for no limit), in the following format:
+        [client_id, topic, first_msg_id, first_msg_content, second_msg_content, ...]
         """
+        next_message_id = self.next_message_of_client(client_id, topic, msg_id)
+        return self.messages_from(client_id, topic, next_message_id, max_count, max_bytes)
 
+    def next_message_of_client(self, client_id: int, topic: str, msg_id: int = None) -> int:
+        """
+        Returns the id of the next message to send to the client, given the one it requested
+        """
         last_message_id = self.client_dict[client_id][topic]
 
         # Probably one ack has been lost. Since the client is requesting a message higher 
         # than the last ack + 1
         if msg_id is not None and msg_id > last_message_id + 1:
-            print(f"Updating state by get:: prev {last_message_id}, new: {msg_id - 1}")
-            self.client_dict[client_id][topic] = msg_id - 1
-            next_message_id = msg_id
-        else:
-            next_message_id = last_message_id + 1
+            Logger.lost_ack(client_id, topic, last_message_id, msg_id)
+            self.set_client_last_message(client_id, topic, msg_id - 1)
+            return msg_id
+        return last_message_id + 1
 
+    def messages_from(self, client_id: int, topic: str, next_message_id: int, max_count: int,
+                      max_bytes: int = 0) -> list | None:
         # There's no message for this client,
         # it needs to wait for a new message from a publisher
-        if next_message_id not in self.topic_dict[topic]:
+        topic_log = self.topic_dict[topic]
+        next_message = topic_log.get(next_message_id)
+        if next_message is None:
+            return None
+
+        # The first message is always sent, even if it is bigger than the budget
+        message = [client_id, topic, next_message_id, next_message]
+        size = len(next_message)
+        for message_id in range(next_message_id + 1, min(next_message_id + max_count, topic_log.next_offset)):
+            size += topic_log.size(message_id)
+            if max_bytes and size > max_bytes:
+                break
+            message.append(topic_log.get(message_id))
+
+        return message
+
+    def message_for_stream(self, client_id: int, topic: str) -> list | None:
+        """
+        Returns the messages that can be pushed to a streaming client without exceeding its credit,
+        in the same format as message_for_client, and marks them as sent
+        """
+        stream = self.streams[topic][client_id]
+        window, last_sent = stream
+        last_message_id = self.client_dict[client_id][topic]
+
+        # The credit is replenished as the client acknowledges the messages
+        next_message_id = max(last_sent, last_message_id) + 1
+        credit = last_message_id + window - next_message_id + 1
+        if credit <= 0:
             return None
 
-        next_message = self.topic_dict[topic][next_message_id]
-        return [client_id, topic, next_message_id, next_message]
+        message = self.messages_from(client_id, topic, next_message_id, credit)
+        if message is not None:
+            stream[1] = next_message_id + len(message) - 4
+        return message
+
+    def get_streams(self, topic: str) -> dict:
+        return self.streams.get(topic, {})
+
+    def is_streaming(self, client_id: int, topic: str) -> bool:
+        return client_id in self.streams.get(topic, {})
 
-    def get_waiting_list(self, topic: str) -> list:
-        return self.pending_clients[topic]
+    def waiting_count(self, topic: str) -> int:
+        return len(self.waiting_clients[topic])
 
     def is_sub_waiting(self, client_id: int, topic: str) -> bool:
-        pending = self.pending_clients.get(topic)
+        return client_id in self.waiting_clients.get(topic, {})
 
-        if pending is None:
-            return False
-        
-        return client_id in pending
+    def timed_waits(self) -> list:
+        """
+        Returns (client, topic, milliseconds) of every client waiting with a time limit
+        """
+        return [(client_id, topic, waiting[3]) for topic, clients in self.waiting_clients.items()
+                for client_id, waiting in clients.items() if waiting[3] > 0]
 
     def is_unsubscribed_topic(self, topic: str) -> bool:
-        for client in self.client_dict.keys():
-            client_topics = self.client_dict[client].keys()
-            if topic in client_topics:
-                return False
-        return True
+        return self.subscriber_count(topic) == 0
+
+    def subscriber_count(self, topic: str) -> int:
+        return len(self.topic_subscribers.get(topic, ()))
+
+    def is_subscribed(self, client_id: int, topic: str) -> bool:
+        return client_id in self.topic_subscribers.get(topic, ())
+
+    def subscribed_topics(self) -> list:
+        return [topic for topic, subscribers in self.topic_subscribers.items() if subscribers]
 
     def is_unsubscribed_client(self, client_id: str) -> bool:
         return self.client_dict[client_id] == {}
 
     def first_message(self, topic: str) -> int:
-        if not self.topic_dict[topic]:
-            return -1
-        return next(iter(self.topic_dict[topic].keys()))
+        return self.topic_dict[topic].first()
+
+    def topics(self) -> list:
+        return list(self.topic_dict)
+
+    def retained_messages(self, topic: str) -> int:
+        return len(self.topic_dict[topic])
+
+    def retained_bytes(self, topic: str) -> int:
+        return self.topic_dict[topic].retained_bytes
+
+    def backlog(self, topic: str) -> int:
+        """
+        Returns how many messages the slowest subscriber of the topic did not receive yet
+        """
+        if self.is_unsubscribed_topic(topic):
+            return 0
+        return self.last_message_of_topic(topic) - self.last_message_received_by_all(topic)
 
     def last_message_received_by_all(self, topic: str) -> int:
-        result = float('inf')
-        for topics in self.client_dict.values():
-            if topic in topics:
-                result = min(result, topics[topic])
-        return result
+        if self.is_unsubscribed_topic(topic):
+            return float('inf')
+        return self.watermarks[topic].minimum()
+
+    def is_topic_full(self, topic: str, retention: Retention, size: int) -> bool:
+        """
+        Returns true if a message of the given size can not be added to the topic without exceeding its retention
+        """
+        if topic not in self.topic_dict:
+            return False
+        return retention.is_full(self.topic_dict[topic], size, time.time())
+
+    def retention_limit(self, topic: str, retention: Retention) -> int | None:
+        """
+        Returns the id of the last message that exceeds the retention of the topic, None if no message does
+        """
+        topic_log = self.topic_dict[topic]
+        first_to_keep = retention.first_to_keep(topic_log, time.time())
+        if first_to_keep <= topic_log.base_offset:
+            return None
+        return first_to_keep - 1
+
+    def lagging_subscribers(self, topic: str, limit: int) -> list:
+        """
+        Returns the subscribers that did not receive every message until limit
+        """
+        return [client_id for client_id in self.topic_subscribers[topic] if self.client_dict[client_id][topic] < limit]
+
+    def missing_publishers(self) -> list:
+        """
+        Returns the (publisher, topic) with publications missing
+        """
+        return [(pub_id, topic) for pub_id, topics in self.publish_dict.items()
+                for topic, pub_topic_state in topics.items() if pub_topic_state.waiting_messages]
+
+    def missing_publications(self, pub_id: int, topic: str) -> list:
+        """
+        Returns the (first, last) ranges of the publications missing from the publisher
+        """
+        return self.get_publish_dict(pub_id, topic).waiting_messages.ranges()
+
+    def get_client_codec(self, client_id: int) -> str:
+        return self.client_codecs.get(client_id, TEXT)
+
+    def get_publisher_codec(self, pub_id: int) -> str:
+        return self.publisher_codecs.get(pub_id, TEXT)
 
     def get_publish_dict(self, pub_id: int, topic: str):
         if self.publish_dict.get(pub_id) is None:
@@ -126,9 +327,20 @@ class ServerState(State):
         Adds a topic to the topics data structure if it is not in it already
         """
         if topic not in self.topic_dict:
-            self.topic_dict[topic] = {}
+            segments_directory = os.path.splitext(self.data_path)[0] + "_segments"
+            # The journal replays the creations in the same order, so a topic gets back the same generation
+            self.topic_dict[topic] = TopicLog(os.path.join(segments_directory, topic.encode('utf-8').hex()),
+                                              generation=self.topic_logs_created)
+            self.topic_logs_created += 1
         if topic not in self.pending_clients:
-            self.pending_clients[topic] = []
+            self.pending_clients[topic] = WaitingIndex()
+            self.waiting_clients[topic] = {}
+        if topic not in self.streams:
+            self.streams[topic] = {}
+        if topic not in self.watermarks:
+            self.watermarks[topic] = OffsetIndex()
+        if topic not in self.topic_subscribers:
+            self.topic_subscribers[topic] = set()
 
     def add_client(self, client_id: int) -> None:
         """
@@ -137,46 +349,118 @@ class ServerState(State):
         if client_id not in self.client_dict:
             self.client_dict[client_id] = {}
 
-    def add_message(self, topic: str, message: str) -> int:
+    def add_message(self, topic: str, message, timestamp: float = None) -> int:
         """
         Adds a message to the data structure and returns the id created for it
         """
+        if timestamp is None:
+            timestamp = time.time()
+        self.log('add_message', topic, TopicLog.serializable(message), timestamp)
         self.add_topic(topic)
         # The ids are sequential
-        new_id = self.last_message_of_topic(topic) + 1
-        self.topic_dict[topic][new_id] = message
-        return new_id
+        return self.topic_dict[topic].append(message, timestamp)
 
     def add_subscriber(self, client_id: int, topic: str) -> None:
         """
         Adds a subscriber to the topics structure
         """
+        self.log('add_subscriber', client_id, topic)
         self.add_topic(topic)
         self.add_client(client_id)
         # The next message this client needs to receive is the next of the topic
-        self.client_dict[client_id][topic] = self.last_message_of_topic(topic)
+        position = self.last_message_of_topic(topic)
+        previous_position = self.client_dict[client_id].get(topic)
+        if previous_position is None:
+            self.watermarks[topic].add(position)
+        else:
+            self.watermarks[topic].move(previous_position, position)
+        self.client_dict[client_id][topic] = position
+        self.topic_subscribers[topic].add(client_id)
+
+    def add_to_waiting_list(self, client_id: int, topic: str, max_count: int = 1, max_bytes: int = 0,
+                            wait: int = 0) -> None:
+        """
+        Makes the client wait for its next message, replacing the GET it was already waiting with.
+        The wait is the milliseconds the GET is kept waiting, 0 to keep it until a message arrives.
+        """
+        self.log('add_to_waiting_list', client_id, topic, max_count, max_bytes, wait)
+        self.remove_from_waiting_list(client_id, topic)
+        requested = self.client_dict[client_id][topic] + 1
+        self.pending_clients[topic].add(requested, client_id)
+        self.waiting_clients[topic][client_id] = (requested, max_count, max_bytes, wait)
+
+    def open_stream(self, client_id: int, topic: str, window: int) -> None:
+        """
+        Starts pushing the messages of the topic to the client, at most window messages ahead of its last ACK
+        """
+        self.log('open_stream', client_id, topic, window)
+        self.streams[topic][client_id] = [window, self.client_dict[client_id][topic]]
 
-    def add_to_waiting_list(self, client_id: int, topic: str) -> None:
-        self.pending_clients[topic].append(client_id)
+    def add_publisher_waiting(self, pub_id: int, topic: str, first: int, last: int) -> None:
+        """
+        Adds the messages from first to last to the ones missing from the publisher
+        """
+        self.log('add_publisher_waiting', pub_id, topic, first, last)
+        self.get_publish_dict(pub_id, topic).add_waiting_range(first, last)
 
     # --------------------------------------------------------------------------
     # Update data
     # --------------------------------------------------------------------------
 
     def update_client_last_message(self, client_id: int, topic: str, message_id: int) -> None:
+        self.log('update_client_last_message', client_id, topic, message_id)
+        low_watermark = self.last_message_received_by_all(topic)
+        self.move_client(client_id, topic, message_id)
+
+        # Messages can only be deleted if the slowest subscriber moved forward
+        if self.last_message_received_by_all(topic) != low_watermark:
+            self.collect_garbage(topic)
+
+    def set_client_last_message(self, client_id: int, topic: str, message_id: int) -> None:
+        """
+        Moves the position of a client without collecting the garbage of the topic
+        """
+        self.log('set_client_last_message', client_id, topic, message_id)
+        self.move_client(client_id, topic, message_id)
+
+    def move_client(self, client_id: int, topic: str, message_id: int) -> None:
+        self.watermarks[topic].move(self.client_dict[client_id][topic], message_id)
         self.client_dict[client_id][topic] = message_id
-        self.collect_garbage(topic)
+
+    def update_client_codec(self, client_id: int, codec: str) -> None:
+        if self.client_codecs.get(client_id, TEXT) == codec:
+            return
+        self.log('update_client_codec', client_id, codec)
+        self.client_codecs[client_id] = codec
+
+    def update_publisher_codec(self, pub_id: int, codec: str) -> None:
+        if self.publisher_codecs.get(pub_id, TEXT) == codec:
+            return
+        self.log('update_publisher_codec', pub_id, codec)
+        self.publisher_codecs[pub_id] = codec
+
+    def update_publisher_last_message(self, pub_id: int, topic: str, msg_id: int) -> None:
+        self.log('update_publisher_last_message', pub_id, topic, msg_id)
+        self.get_publish_dict(pub_id, topic).last_msg = msg_id
 
     # --------------------------------------------------------------------------
     # Remove data
     # --------------------------------------------------------------------------
 
     def delete_messages_until(self, topic: str, limit: int) -> None:
-        key_list = list(iter(self.topic_dict[topic].keys()))
-        for key in key_list:
-            if key > limit:
-                break
-            self.topic_dict[topic].pop(key)
+        self.dropped_segments.extend(self.topic_dict[topic].truncate_until(limit))
+
+    def drop_messages_until(self, topic: str, limit: int) -> list:
+        """
+        Deletes every message until limit, even if some subscribers did not receive them.
+        Returns the subscribers that were moved past the deleted messages.
+        """
+        self.log('drop_messages_until', topic, limit)
+        lagging = self.lagging_subscribers(topic, limit)
+        for client_id in lagging:
+            self.move_client(client_id, topic, limit)
+        self.delete_messages_until(topic, limit)
+        return lagging
 
     def collect_garbage(self, topic: str) -> None:
 
@@ -191,25 +475,82 @@ class ServerState(State):
             self.delete_messages_until(topic, last_message - 1)
 
     def remove_topic(self, topic: str) -> None:
-        self.topic_dict.pop(topic)
+        self.dropped_segments.extend(self.topic_dict.pop(topic).segments)
         self.pending_clients.pop(topic)
+        self.waiting_clients.pop(topic)
+        self.streams.pop(topic)
+        self.watermarks.pop(topic)
+        self.topic_subscribers.pop(topic)
 
     def remove_subscriber(self, client_id: int, topic: str) -> None:
         """
         Removes a subscriber from the topics structure
         """
-        self.client_dict[client_id].pop(topic)
+        self.log('remove_subscriber', client_id, topic)
+        low_watermark = self.last_message_received_by_all(topic)
+        self.watermarks[topic].remove(self.client_dict[client_id].pop(topic))
+        self.topic_subscribers[topic].discard(client_id)
+        self.streams[topic].pop(client_id, None)
+        self.remove_from_waiting_list(client_id, topic)
 
         if self.is_unsubscribed_topic(topic):
             self.remove_topic(topic)
+        elif self.last_message_received_by_all(topic) != low_watermark:
+            # The slowest subscriber left
+            self.collect_garbage(topic)
+
+    def close_stream(self, client_id: int, topic: str) -> None:
+        self.log('close_stream', client_id, topic)
+        self.streams[topic].pop(client_id, None)
+
+    def remove_publisher_waiting(self, pub_id: int, topic: str, msg_id: int) -> None:
+        self.log('remove_publisher_waiting', pub_id, topic, msg_id)
+        self.get_publish_dict(pub_id, topic).remove_waiting(msg_id)
+
+    def remove_from_waiting_list(self, client_id: int, topic: str) -> None:
+        waiting = self.waiting_clients[topic].pop(client_id, None)
+        if waiting is None:
+            return
+        self.pending_clients[topic].remove(waiting[0], client_id)
+
+    def cancel_wait(self, client_id: int, topic: str) -> int:
+        """
+        Removes the client from the waiting list and returns the message it was waiting for
+        """
+        self.log('cancel_wait', client_id, topic)
+        requested = self.waiting_clients[topic][client_id][0]
+        self.remove_from_waiting_list(client_id, topic)
+        return requested
 
-    def empty_waiting_list(self, topic: str) -> None:
-        self.pending_clients[topic] = []
+    def wake_waiting_clients(self, topic: str, message_id: int) -> dict:
+        """
+        Removes from the waiting list the clients whose requested message exists once message_id is added,
+        and returns them grouped by the messages they are sent:
+        groups[(requested message, max messages, max bytes)] = list of clients
+        """
+        pending = self.pending_clients[topic]
+        if pending.minimum() > message_id:
+            return {}
+        self.log('wake_waiting_clients', topic, message_id)
+
+        groups = {}
+        waiting = self.waiting_clients[topic]
+        for _, clients in pending.pop_until(message_id):
+            for client_id in clients:
+                key = waiting.pop(client_id)[:3]
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = [client_id]
+                else:
+                    group.append(client_id)
+        return groups
 
     def __str__(self):
-        str_topic_dict = json.dumps(self.topic_dict)
+        str_topic_dict = json.dumps({topic: {msg_id: bytes(content).decode('utf-8', 'replace') for msg_id, content in log.items()}
+                                     for topic, log in self.topic_dict.items()})
         str_client_dict = json.dumps(self.client_dict)
-        str_pending_clients = json.dumps(self.pending_clients)
+        str_pending_clients = json.dumps({topic: {requested: sorted(clients) for requested, clients in pending.items()}
+                                          for topic, pending in self.pending_clients.items()})
         return f"""
             [TOPICS] topic_dict[<topic>][<message_id>] = message
             {str_topic_dict}
@@ -217,6 +558,6 @@ class ServerState(State):
             [CLIENTS] client_dict[<client_id>][<topic>] = last_message_received
             {str_client_dict}
 
-            [PENDING CLIENTS] pending_client[<topic>] = list of clients waiting
+            [PENDING CLIENTS] pending_client[<topic>][<requested message>] = clients waiting for it
             {str_pending_clients}
         """
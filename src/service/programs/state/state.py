@@ -8,10 +8,23 @@ class State:
         current_path = os.path.dirname(__file__) + "../"
         self.data_path = os.path.join(current_path, data_path)
 
-    def save_state(self):
-        f = open(self.data_path, 'wb+')
-        pickle.dump(self, f)
+    def save_state(self, sync: bool = False):
+        self.write_state(self.serialize(), sync)
+
+    def serialize(self) -> bytes:
+        # The payload frames are pickled as buffers, which needs the protocol 5
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def write_state(self, data: bytes, sync: bool = False):
+        # Writes to a temporary file first, so a crash never leaves a half written state
+        temporary_path = self.data_path + ".tmp"
+        f = open(temporary_path, 'wb+')
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
         f.close()
+        os.replace(temporary_path, self.data_path)
 
     @staticmethod
     def get_state_from_file(data_path: str):
@@ -3,23 +3,63 @@ from __future__ import annotations
 import json
 import os
 
+from ..log.logger import Logger
+from .offset_checkpoint import OffsetCheckpoint
 from .state import State
 
 
 class SubscriberState(State):
+    """
+    The topics are pickled when the subscriber starts, while the messages received and the last GET
+    are written in place to a checkpoint file, with a fsync every few acknowledgements.
+    """
+
     # --------------------------------------------------------------------------
     # Initialization
     # --------------------------------------------------------------------------
 
+    # Runs received between each fsync of the checkpoint, their ACKs are held until it
+    SYNC_ACKS = 16
+    # Slot of the checkpoint with the index of the last topic requested, the topics use the next ones
+    LAST_GET_SLOT = 0
+
     topics: list  # subscribed topics
     messages_received: dict  # messages_received[topic] = message_id
     last_get: str | None  # last topic that was requested with GET
+    checkpoint: OffsetCheckpoint | None
+    unsynced_acks: int  # Runs written to the checkpoint since the last fsync, their ACKs are not sent yet
 
     def __init__(self, data_path: str, topics_json: str) -> None:
         super().__init__(data_path)
         self.topics = self.get_topics(topics_json)
         self.messages_received = {}
         self.last_get = None
+        self.checkpoint = None
+        self.unsynced_acks = 0
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['checkpoint'] = None
+        return state
+
+    def checkpoint_path(self) -> str:
+        return os.path.splitext(self.data_path)[0] + ".offsets"
+
+    def open_checkpoint(self) -> None:
+        """
+        Opens the checkpoint, whose values are newer than the ones pickled
+        """
+        self.checkpoint = OffsetCheckpoint(self.checkpoint_path(), len(self.topics) + 1)
+        self.unsynced_acks = 0
+
+        for slot, topic in enumerate(self.topics, SubscriberState.LAST_GET_SLOT + 1):
+            msg_id = self.checkpoint.read(slot)
+            if msg_id is not None:
+                self.messages_received[topic] = msg_id
+
+        topic_index = self.checkpoint.read(SubscriberState.LAST_GET_SLOT)
+        if topic_index is not None:
+            self.last_get = self.topics[topic_index] if topic_index >= 0 else None
 
     def get_topics(self, topics_json: str):
         f = open(topics_json + ".json")
@@ -31,7 +71,22 @@ class SubscriberState(State):
         return not os.path.isfile(data_path)
 
     def add_message(self, topic: str, msg_id: int):
+        """
+        Registers the last message received of a topic, before it is acknowledged
+        """
         self.messages_received[topic] = msg_id
+        self.checkpoint.write(self.topics.index(topic) + 1, msg_id)
+        self.unsynced_acks += 1
+
+    def needs_sync(self) -> bool:
+        return self.unsynced_acks >= SubscriberState.SYNC_ACKS
+
+    def sync(self) -> None:
+        """
+        Makes the checkpoint durable, the acknowledgements are cumulative so one fsync covers the previous ones
+        """
+        self.checkpoint.sync()
+        self.unsynced_acks = 0
 
     def get_next_message(self, topic: str):
         if self.messages_received.get(topic) is None:
@@ -49,13 +104,24 @@ class SubscriberState(State):
         return ["ACK", self.last_get, msg_id]
 
     def set_last_get(self, topic: str):
+        if topic == self.last_get:
+            return
         self.last_get = topic
+        self.checkpoint.write(SubscriberState.LAST_GET_SLOT, self.topics.index(topic))
+
+    def save_state(self, sync: bool = True):
+        super().save_state(sync)
+        self.sync()
 
     @staticmethod
     def read_state(data_path: str, topics_json: str):
         state = State.get_state_from_file(data_path)
         if state is None:
-            return SubscriberState(data_path, topics_json)
+            state = SubscriberState(data_path, topics_json)
+            # A checkpoint without a state belongs to a subscriber that was deleted
+            if os.path.exists(state.checkpoint_path()):
+                os.remove(state.checkpoint_path())
+        state.open_checkpoint()
         return state
 
     def __str__(self):
@@ -75,6 +141,7 @@ class SubscriberState(State):
         """
 
     def delete(self):
+        self.checkpoint.delete()
         if os.path.exists(self.data_path):
             os.remove(self.data_path)
-            print("=== State deleted ===")
+            Logger.info("=== State deleted ===")
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import os
+import pickle
+from array import array
+from bisect import bisect_right
+
+import zmq
+
+from .segment import Segment
+
+
+class TopicLog:
+    """
+    Messages retained for a topic, indexed by their sequential ids.
+    The ids between base_offset and next_offset - 1 are retained, so appending,
+    looking up a message and truncating a prefix never scan the retained messages.
+    The contents are appended to memory-mapped segment files and only the position
+    of each message is kept in memory, so the retained messages do not grow the memory used.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    # Minimum number of truncated slots before the index is compacted
+    COMPACT_THRESHOLD = 1024
+    SEGMENT_SIZE = 4 * 1024 * 1024
+
+    directory: str  # Directory of the segment files of the topic
+    generation: int  # Logs of the same topic have different generations, so their segment files never collide
+    segment_size: int  # Bytes of a segment, unless a single message is bigger
+    base_offset: int  # Id of the first retained message
+    next_offset: int  # Id that the next appended message will have
+    positions: array  # positions[head + (id - base_offset)] = position of the message in its segment
+    lengths: array  # lengths[head + (id - base_offset)] = length of the message
+    timestamps: array  # timestamps[head + (id - base_offset)] = time the message was added
+    retained_bytes: int  # Sum of the lengths of the retained messages
+    head: int  # Position of the first retained message in the index
+    segments: list  # Segments with retained messages, ordered by the first id they contain
+    segment_ids: list  # First id of each segment, to find the segment of a message
+    write_position: int  # Position in the last segment where the next message is written
+    unflushed: list  # Segments written since the last flush
+
+    def __init__(self, directory: str, segment_size: int = SEGMENT_SIZE, first_id: int = 0,
+                 generation: int = 0) -> None:
+        self.directory = directory
+        self.generation = generation
+        self.segment_size = segment_size
+        self.base_offset = first_id
+        self.next_offset = first_id
+        self.positions = array('q')
+        self.lengths = array('q')
+        self.timestamps = array('d')
+        self.retained_bytes = 0
+        self.head = 0
+        self.segments = []
+        self.segment_ids = []
+        self.write_position = 0
+        self.unflushed = []
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def serializable(message):
+        """
+        Returns the message in a form that pickle can write without an intermediate copy
+        """
+        if isinstance(message, zmq.Frame):
+            return pickle.PickleBuffer(memoryview(message).toreadonly())
+        return message
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        # The segment files are mapped again when they are first used
+        os.makedirs(self.directory, exist_ok=True)
+
+    # --------------------------------------------------------------------------
+    # Get data
+    # --------------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self.next_offset - self.base_offset
+
+    def __contains__(self, msg_id: int) -> bool:
+        return self.base_offset <= msg_id < self.next_offset
+
+    def get(self, msg_id: int) -> memoryview | None:
+        """
+        Returns a view of the content of a message, read from its segment
+        """
+        if msg_id not in self:
+            return None
+        i = self.head + msg_id - self.base_offset
+        segment = self.segments[bisect_right(self.segment_ids, msg_id) - 1]
+        return segment.read(self.positions[i], self.lengths[i])
+
+    def size(self, msg_id: int) -> int:
+        return self.lengths[self.head + msg_id - self.base_offset]
+
+    def timestamp(self, msg_id: int) -> float:
+        return self.timestamps[self.head + msg_id - self.base_offset]
+
+    def first(self) -> int:
+        """
+        Returns the id of the first retained message, -1 if there are none
+        """
+        if len(self) == 0:
+            return -1
+        return self.base_offset
+
+    def last(self) -> int:
+        """
+        Returns the id of the last message appended, -1 if there was none
+        """
+        return self.next_offset - 1
+
+    def items(self):
+        for msg_id in range(self.base_offset, self.next_offset):
+            yield msg_id, self.get(msg_id)
+
+    # --------------------------------------------------------------------------
+    # Update data
+    # --------------------------------------------------------------------------
+
+    def append(self, message, timestamp: float = 0) -> int:
+        """
+        Appends a message and returns the id created for it
+        """
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        length = len(message)
+
+        # A message is never split between two segments
+        if not self.segments or self.write_position + length > self.segments[-1].size:
+            self.add_segment(max(self.segment_size, length))
+
+        segment = self.segments[-1]
+        segment.write(self.write_position, message)
+        if not self.unflushed or self.unflushed[-1] is not segment:
+            self.unflushed.append(segment)
+
+        self.positions.append(self.write_position)
+        self.lengths.append(length)
+        self.timestamps.append(timestamp)
+        self.retained_bytes += length
+        self.write_position += length
+        self.next_offset += 1
+        return self.next_offset - 1
+
+    def add_segment(self, size: int) -> None:
+        segment = Segment(self.directory, self.next_offset, size, self.generation)
+        segment.open()
+        self.segments.append(segment)
+        self.segment_ids.append(self.next_offset)
+        self.write_position = 0
+
+    def truncate_until(self, limit: int) -> list:
+        """
+        Removes every message with an id lower or equal to limit.
+        Returns the segments left without messages, their files are removed by the caller.
+        """
+        limit = min(limit, self.next_offset - 1)
+        if limit < self.base_offset:
+            return []
+        new_head = self.head + limit - self.base_offset + 1
+        self.retained_bytes -= sum(self.lengths[self.head:new_head])
+        self.head = new_head
+        self.base_offset = limit + 1
+
+        # The last segment is kept, the next messages are written to it
+        dropped = []
+        while len(self.segments) > 1 and self.segment_ids[1] <= self.base_offset:
+            dropped.append(self.segments.pop(0))
+            self.segment_ids.pop(0)
+
+        # Compacts the index once most of it is made of truncated slots
+        if self.head >= TopicLog.COMPACT_THRESHOLD and self.head * 2 >= len(self.positions):
+            del self.positions[:self.head]
+            del self.lengths[:self.head]
+            del self.timestamps[:self.head]
+            self.head = 0
+        return dropped
+
+    def take_unflushed(self) -> list:
+        """
+        Returns the segments written since the last call, whose pages must be flushed before a snapshot
+        """
+        unflushed, self.unflushed = self.unflushed, []
+        return unflushed
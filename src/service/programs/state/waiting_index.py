@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import heapq
+
+
+class WaitingIndex:
+    """
+    Clients waiting for the messages of a topic, grouped by the message they requested.
+    Keeps the requested messages ordered, so a new message only goes through the requests it satisfies.
+    """
+
+    # --------------------------------------------------------------------------
+    # Attributes
+    # --------------------------------------------------------------------------
+
+    clients: dict  # clients[<requested message>] = set of clients waiting for it
+    heap: list  # Requested messages of clients, it may keep messages no client waits for anymore
+
+    def __init__(self) -> None:
+        self.clients = {}
+        self.heap = []
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    # --------------------------------------------------------------------------
+    # Get data
+    # --------------------------------------------------------------------------
+
+    def items(self):
+        return self.clients.items()
+
+    def minimum(self) -> int | float:
+        """
+        Returns the lowest message requested, infinity if no client waits
+        """
+        # Requests without clients are only dropped once they reach the top of the heap
+        while self.heap and self.heap[0] not in self.clients:
+            heapq.heappop(self.heap)
+
+        if not self.heap:
+            return float('inf')
+        return self.heap[0]
+
+    # --------------------------------------------------------------------------
+    # Update data
+    # --------------------------------------------------------------------------
+
+    def add(self, requested: int, client_id: int) -> None:
+        clients = self.clients.get(requested)
+        if clients is not None:
+            clients.add(client_id)
+            return
+
+        self.clients[requested] = {client_id}
+        heapq.heappush(self.heap, requested)
+
+        # Rebuilds the heap when most of it is made of requests without clients
+        if len(self.heap) > 2 * len(self.clients) + 64:
+            self.heap = list(self.clients)
+            heapq.heapify(self.heap)
+
+    def remove(self, requested: int, client_id: int) -> None:
+        clients = self.clients[requested]
+        clients.discard(client_id)
+        if not clients:
+            del self.clients[requested]
+
+    def pop_until(self, message_id: int) -> list:
+        """
+        Removes the clients that requested message_id or an earlier message, and returns them
+        as (requested message, set of clients), from the lowest message requested
+        """
+        ready = []
+        while self.heap and self.heap[0] <= message_id:
+            requested = heapq.heappop(self.heap)
+            # A request may be in the heap more than once, if its clients left and others came
+            clients = self.clients.pop(requested, None)
+            if clients is not None:
+                ready.append((requested, clients))
+        return ready
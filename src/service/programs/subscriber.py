@@ -1,12 +1,13 @@
 from __future__ import annotations
 
-import random
 import os
 import zmq
 
 from .client import Client
 from .log.logger import Logger
-from .message.message_parser import MessageParser
+from .message.codecs import NOT_SUBSCRIBED
+from .message.codecs import TEXT
+from .message.codecs import get_parser
 from .state.subscriber_state import SubscriberState
 
 
@@ -18,13 +19,27 @@ class Subscriber(Client):
     data_path: str
     topics: list
     state: SubscriberState
+    batch_size: int  # Maximum number of messages received for each GET
+    batch_bytes: int  # Maximum bytes of content received for each GET, 0 for no limit
+    stream_window: int  # Messages the server may push without being acknowledged, 0 to request them with GET
+    get_wait: int  # Milliseconds the server keeps a GET waiting for messages, 0 to wait until they arrive
+    codec: str  # Codec of the messages exchanged with the server
+    held_acks: dict  # held_acks[topic] = (first, last) ids of the messages received that are not acknowledged yet
 
     # --------------------------------------------------------------------------
     # Initialization of subscriber
     # --------------------------------------------------------------------------
 
-    def __init__(self, topics_json: str, client_id: str):
+    def __init__(self, topics_json: str, client_id: str, batch_size: int = 10, batch_bytes: int = 0,
+                 stream_window: int = 0, get_wait: int = 5000, codec: str = TEXT):
         super().__init__(client_id)
+        self.codec = codec
+        self.parser = get_parser(codec)
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.stream_window = stream_window
+        self.get_wait = get_wait
+        self.held_acks = {}
 
         # State
         current_data_path = os.path.abspath(os.getcwd())
@@ -33,7 +48,9 @@ class Subscriber(Client):
         self.state = SubscriberState.read_state(data_path, topics_json)
 
         self.create_sockets()
+        self.start_session(data_path)
 
+    def start_session(self, data_path: str) -> None:
         # Subscribe if the subscriber is new, handle crash otherwise
         if self.state.is_new_subscriber(data_path):
             self.subscribe_topics()
@@ -67,20 +84,50 @@ class Subscriber(Client):
             Logger.unsubscribe(topic)
 
     def subscribe(self, topic: str) -> None:
-        self.dealer.send_multipart(MessageParser.encode(["SUB", topic]))
+        self.dealer.send_multipart(self.parser.encode_request("SUB", topic))
 
     def unsubscribe(self, topic: str) -> None:
-        self.dealer.send_multipart(MessageParser.encode(["UNSUB", topic]))
+        self.dealer.send_multipart(self.parser.encode_request("UNSUB", topic))
 
     # --------------------------------------------------------------------------
     # Message handling functions
     # --------------------------------------------------------------------------
 
     def get(self, topic: str) -> None:
+        self.acknowledge()
+        self.dealer.send_multipart(self.get_request(topic))
+        Logger.get(self.id, topic)
+
+    def get_request(self, topic: str) -> list:
         self.state.set_last_get(topic)
         msg_id = self.state.get_next_message(topic)
-        self.dealer.send_multipart(MessageParser.encode(['GET', topic, msg_id]))
-        Logger.get(self.id, topic)
+        return self.parser.encode_request('GET', topic, msg_id, self.batch_size, self.batch_bytes, self.get_wait)
+
+    def multi_get(self, topics: list) -> None:
+        """ Asks for the next messages of several topics in one request, they share the budget of a GET. """
+        self.acknowledge()
+        self.dealer.send_multipart(self.multi_get_request(topics))
+        Logger.multi_get(self.id, topics)
+
+    def multi_get_request(self, topics: list) -> list:
+        # The topics of a multi-topic GET wait together, the SYNC of the first one tells if it is waiting
+        self.state.set_last_get(topics[0])
+        requests = [(topic, self.state.get_next_message(topic)) for topic in topics]
+        return self.parser.encode_multi_get(requests, self.batch_size, self.batch_bytes, self.get_wait)
+
+    def rotated_topics(self, turn: int) -> list:
+        """ Returns the topics starting by a different one each turn, so none of them always gets the budget last. """
+        start = turn % len(self.state.topics)
+        return self.state.topics[start:] + self.state.topics[:start]
+
+    def stream(self, topic: str, window: int) -> None:
+        """ Asks the server to push the messages of the topic, or to stop if the window is 0. """
+        self.acknowledge()
+        self.dealer.send_multipart(self.stream_request(topic, window))
+        Logger.stream(self.id, topic, window)
+
+    def stream_request(self, topic: str, window: int) -> list:
+        return self.parser.encode_request('STREAM', topic, self.state.get_next_message(topic), window)
 
     def handle_crash(self):
         """ Send ACK to the last topic requested with a GET before crashing.
@@ -89,7 +136,7 @@ class Subscriber(Client):
         # Send last ACK
         ack_message = self.state.get_last_ack()
         if ack_message is not None:
-            self.dealer.send_multipart(MessageParser.encode(ack_message))
+            self.dealer.send_multipart(self.parser.encode_request(*ack_message))
 
         # SYNC with the server
         self.sync_with_server()
@@ -105,50 +152,121 @@ class Subscriber(Client):
             # Wait for answer to GET
             self.handle_msg()
             return
-        elif answer == "NOT WAITING":
-            # Check if a GET response is in the queue
-            poller = zmq.Poller()
-            poller.register(self.dealer, zmq.POLLIN)
-            socks = dict(poller.poll(250))
-
-            for i in range(3):
-                if socks.get(self.sync) == zmq.POLLIN:
-                    self.handle_msg()
-                    return
+        elif answer == "NOT WAITING" and self.dealer.poll(250):
+            # A GET response is in the queue
+            self.handle_msg()
 
     def handle_msg(self) -> None:
-        """ This function receive a message of a topic and sends the ACK. """
+        """ This function receive the runs of consecutive messages of a reply, their ACKs are held until the
+        checkpoint is synced. """
+
+        for request in self.receive(self.dealer.recv_multipart()):
+            self.dealer.send_multipart(request)
+
+        # The fsync is only done every few runs, or once the server has no credit left to push messages
+        if self.state.needs_sync() or self.stream_stalled():
+            self.acknowledge()
 
-        [topic, msg_id, content] = MessageParser.decode(
-            self.dealer.recv_multipart())
+    def acknowledge(self) -> None:
+        """ Syncs the checkpoint and sends a cumulative ACK for each topic with messages held. It is also done before
+        each request for the next messages, since the server takes the offset requested as an ACK. """
 
-        # Duplicated message [extreme case]
-        if int(msg_id) < self.state.get_next_message(topic):
+        if not self.held_acks:
+            return
+        self.state.sync()
+        for request in self.release_acks():
+            self.dealer.send_multipart(request)
+
+    def release_acks(self) -> list:
+        """ Returns the ACKs of the messages held, once the checkpoint that has them is synced. """
+
+        requests = [self.parser.encode_request('ACK', topic, last_id) for topic, (_, last_id) in self.held_acks.items()]
+        self.held_acks = {}
+        return requests
+
+    def stream_stalled(self) -> bool:
+        """ Whether the messages held of a topic use the whole window, the server pushes no more until the ACK. """
+
+        if self.stream_window <= 0:
+            return False
+        return any(last_id - first_id + 1 >= self.stream_window for first_id, last_id in self.held_acks.values())
+
+    def receive(self, raw_message: list) -> list:
+        """ Adds the runs of messages of a reply, of one or several topics, and returns the subscriptions to make
+        again. """
+
+        requests = []
+        for topic, first_id, contents in self.parser.decode_runs(raw_message):
+            # The server no longer has the subscription, the retention evicted it
+            if first_id == NOT_SUBSCRIBED:
+                requests.extend(self.resubscribe(topic))
+                continue
+            self.receive_run(topic, first_id, contents)
+        return requests
+
+    def resubscribe(self, topic: str) -> list:
+        """ Returns the requests that subscribe again to the topic, from the next message of the topic. """
+
+        Logger.resubscribe(topic)
+        requests = [self.parser.encode_request("SUB", topic)]
+        if self.stream_window > 0:
+            requests.append(self.stream_request(topic, self.stream_window))
+        return requests
+
+    def receive_run(self, topic: str, first_id: int, contents: list) -> None:
+        """ Adds a run of messages to the state and holds its ACK, unless the messages were duplicated. """
+
+        # An empty run answers a GET that waited too long
+        if not contents:
+            Logger.timeout(topic)
+            return
+
+        last_id = first_id + len(contents) - 1
+
+        # Duplicated messages [extreme case]
+        next_id = self.state.get_next_message(topic)
+        if last_id < next_id:
             return
 
-        Logger.topic_message(topic, msg_id, content)
-        self.state.add_message(topic, int(msg_id))
-        self.state.save_state()
+        for msg_id in range(max(first_id, next_id), last_id + 1):
+            Logger.topic_message(topic, msg_id, contents[msg_id - first_id])
+        self.state.add_message(topic, last_id)
 
-        self.dealer.send_multipart(
-            MessageParser.encode(['ACK', topic, msg_id]))
+        held_first, _ = self.held_acks.get(topic, (max(first_id, next_id), None))
+        self.held_acks[topic] = (held_first, last_id)
 
     # --------------------------------------------------------------------------
     # Main function of subscriber
     # --------------------------------------------------------------------------
 
     def run(self):
-        
+        if self.stream_window > 0:
+            self.run_stream()
+            return
+
         for i in range(5):
             try:
-                # Get random subscribed topic
-                topic_idx = random.randint(0, len(self.state.topics) - 1)
-                topic = self.state.topics[topic_idx]
+                # Get messages from every subscribed topic
+                self.multi_get(self.rotated_topics(i))
 
-                # Get message from a topic
-                self.get(topic)
+                # Send ACKs
+                self.handle_msg()
+
+            except KeyboardInterrupt:
+                self.state.save_state()
+                Logger.err("Keyboard interrupt")
+                exit()
+
+        self.unsubscribe_topics()
+        self.state.delete()
+
+    def run_stream(self):
+        """ Receives the messages pushed by the server, acknowledging each run to replenish the credit. """
+        for topic in self.state.topics:
+            self.stream(topic, self.stream_window)
 
-                # Send ACK
+        for i in range(5):
+            try:
                 self.handle_msg()
 
             except KeyboardInterrupt:
@@ -156,5 +274,7 @@ class Subscriber(Client):
                 Logger.err("Keyboard interrupt")
                 exit()
 
+        for topic in self.state.topics:
+            self.stream(topic, 0)
         self.unsubscribe_topics()
         self.state.delete()
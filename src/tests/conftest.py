@@ -0,0 +1,62 @@
+import pytest
+import zmq
+
+from service.programs.log.logger import Logger
+from service.programs.message.codecs import TEXT
+from service.programs.message.codecs import get_parser
+from service.programs.program import SocketCreationFunction
+from service.programs.server import Server
+
+# The writer of the logs would outlive the stdout captured by pytest
+Logger.configure(level="off")
+
+
+class LocalServer(Server):
+    """
+    Server bound to ephemeral ports of localhost, whose messages are handled by calling it directly
+    """
+
+    pub_msg_ids: dict  # pub_msg_ids[<topic>] = id of the next publication of the test publisher
+
+    def init_sockets(self) -> None:
+        self.backend = self.create_socket(zmq.XSUB, SocketCreationFunction.BIND, '127.0.0.1:*')
+        self.router = self.create_socket(zmq.ROUTER, SocketCreationFunction.BIND, '127.0.0.1:*')
+        self.fault_pub = self.create_socket(zmq.PUB, SocketCreationFunction.BIND, '127.0.0.1:*')
+        self.sync_sub = self.create_socket(zmq.ROUTER, SocketCreationFunction.BIND, '127.0.0.1:*')
+        self.pub_msg_ids = {}
+
+    def publish(self, topic: str, content: bytes) -> None:
+        pub_msg_id = self.pub_msg_ids.get(topic, 0)
+        self.pub_msg_ids[topic] = pub_msg_id + 1
+        self.handle_publication(get_parser(TEXT).encode_publication(topic, 1, content, pub_msg_id))
+
+    def replies(self) -> list:
+        """
+        Returns the (client id, topic, first message id, contents) sent to the subscribers, and empties the outbox
+        """
+        replies = []
+        for socket, frames in self.outbox:
+            if socket is self.router:
+                for topic, first_id, contents in get_parser(TEXT).decode_runs(frames[1:]):
+                    replies.append((int(bytes(frames[0])), topic, first_id, contents))
+        self.outbox = []
+        return replies
+
+
+@pytest.fixture
+def make_server(tmp_path, monkeypatch):
+    """
+    Returns a function that creates a LocalServer keeping its state in a temporary directory
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    servers = []
+
+    def make(**kwargs) -> LocalServer:
+        server = LocalServer(**kwargs, stats_address=None)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.context.destroy(linger=0)
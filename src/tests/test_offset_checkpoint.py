@@ -0,0 +1,68 @@
+import json
+import os
+
+from service.programs.state.offset_checkpoint import OffsetCheckpoint
+from service.programs.state.subscriber_state import SubscriberState
+
+
+def tear(path: str, record: int) -> None:
+    """
+    Overwrites half of a record, as a write interrupted by a crash
+    """
+    with open(path, "r+b") as f:
+        f.seek(record * OffsetCheckpoint.RECORD.size)
+        f.write(b"\xff" * (OffsetCheckpoint.RECORD.size // 2))
+
+
+def test_torn_write_keeps_the_previous_value(tmp_path):
+    path = str(tmp_path / "offsets")
+    checkpoint = OffsetCheckpoint(path, 2)
+    checkpoint.write(0, 5)
+    checkpoint.write(1, 3)
+    checkpoint.write(0, 7)
+    checkpoint.close()
+
+    # The second value of the slot 0 went to its second record
+    tear(path, 1)
+    checkpoint = OffsetCheckpoint(path, 2)
+    assert checkpoint.read(0) == 5
+    assert checkpoint.read(1) == 3
+
+    # The next write overwrites the torn record, not the one that survived
+    checkpoint.write(0, 8)
+    checkpoint.close()
+    tear(path, 0)
+    assert OffsetCheckpoint(path, 2).read(0) == 8
+
+
+def test_slot_never_written_is_none(tmp_path):
+    path = str(tmp_path / "offsets")
+    checkpoint = OffsetCheckpoint(path, 2)
+    checkpoint.write(0, 5)
+    checkpoint.close()
+
+    tear(path, 0)
+    checkpoint = OffsetCheckpoint(path, 2)
+    assert checkpoint.read(0) is None
+    assert checkpoint.read(1) is None
+
+
+def test_subscriber_falls_back_to_the_previous_message(tmp_path):
+    topics_json = str(tmp_path / "topics")
+    with open(topics_json + ".json", "w") as f:
+        json.dump({"topics": ["weather", "covid"]}, f)
+    data_path = str(tmp_path / "subscriber.pkl")
+
+    state = SubscriberState.read_state(data_path, topics_json)
+    state.save_state()
+    state.add_message("weather", 4)
+    state.add_message("weather", 9)
+    state.sync()
+    state.checkpoint.close()
+
+    # The slot of weather is the one after the last GET, its second record has the message 9
+    tear(state.checkpoint_path(), 2 * 1 + 1)
+    restored = SubscriberState.read_state(data_path, topics_json)
+    assert restored.get_next_message("weather") == 5
+    assert restored.get_next_message("covid") == 0
+    assert os.path.exists(restored.checkpoint_path())
@@ -0,0 +1,45 @@
+from service.programs.message.codecs import NOT_SUBSCRIBED
+from service.programs.message.codecs import TEXT
+from service.programs.message.codecs import get_parser
+from service.programs.sharded_server import PendingMultiGet
+
+
+def multi_get(topics: list, max_count: int, max_bytes: int = 0) -> PendingMultiGet:
+    order = {topic: position for position, topic in enumerate(topics)}
+    return PendingMultiGet(b"1", get_parser(TEXT), order, {}, max_count, max_bytes, 0)
+
+
+def decoded_reply(pending: PendingMultiGet) -> list:
+    frames = pending.reply()
+    assert bytes(frames[0]) == b"1"
+    return get_parser(TEXT).decode_runs(frames[1:])
+
+
+def test_runs_are_merged_in_the_order_of_the_request():
+    pending = multi_get(["weather", "covid", "quiet"], 10)
+    pending.runs.extend([("quiet", 4, ["q"]), ("weather", 0, ["w1", "w2"])])
+    pending.runs.append(("covid", 2, ["c"]))
+
+    assert decoded_reply(pending) == [("weather", 0, ["w1", "w2"]), ("covid", 2, ["c"]), ("quiet", 4, ["q"])]
+
+
+def test_runs_share_the_count_of_the_request():
+    pending = multi_get(["weather", "covid", "quiet"], 3)
+    pending.runs.extend([("covid", 0, ["c1", "c2"]), ("weather", 0, ["w1", "w2"]), ("quiet", 0, ["q"])])
+
+    assert decoded_reply(pending) == [("weather", 0, ["w1", "w2"]), ("covid", 0, ["c1"])]
+
+
+def test_first_message_of_a_run_is_kept_over_the_bytes_left():
+    pending = multi_get(["weather", "covid", "quiet"], 10, max_bytes=4)
+    pending.runs.extend([("weather", 0, ["abc", "de"]), ("covid", 0, ["xyz"]), ("quiet", 0, ["q"])])
+
+    # weather leaves one byte, covid spends it with its first message and quiet gets nothing
+    assert decoded_reply(pending) == [("weather", 0, ["abc"]), ("covid", 0, ["xyz"])]
+
+
+def test_empty_runs_are_kept_once_the_budget_is_spent():
+    pending = multi_get(["weather", "covid", "quiet"], 1)
+    pending.runs.extend([("weather", 0, ["w1", "w2"]), ("quiet", NOT_SUBSCRIBED, []), ("covid", 3, [])])
+
+    assert decoded_reply(pending) == [("weather", 0, ["w1"]), ("covid", 3, []), ("quiet", NOT_SUBSCRIBED, [])]
@@ -0,0 +1,58 @@
+from service.programs.message.codecs import NOT_SUBSCRIBED
+from service.programs.state.retention import Retention
+from service.programs.state.retention import RetentionPolicy
+
+
+def test_drop_oldest_moves_the_lagging_subscribers(make_server):
+    server = make_server(retention={None: Retention(max_messages=3)})
+    server.handle_subscription(1, "weather")
+    for content in (b"a", b"b", b"c", b"d", b"e"):
+        server.publish("weather", content)
+
+    assert server.state.first_message("weather") == 2
+    server.handle_get(1, "weather", 0, max_count=10)
+    assert server.replies() == [(1, "weather", 2, ["c", "d", "e"])]
+
+
+def test_drop_oldest_keeps_a_message_bigger_than_max_bytes(make_server):
+    server = make_server(retention={None: Retention(max_bytes=10)})
+    server.handle_subscription(1, "weather")
+    server.handle_get(1, "weather", 0)
+    assert server.state.is_sub_waiting(1, "weather")
+
+    server.publish("weather", b"x" * 100)
+    assert server.replies() == [(1, "weather", 0, ["x" * 100])]
+    assert not server.state.is_sub_waiting(1, "weather")
+
+
+def test_evict_subscriber_unsubscribes_the_lagging_ones(make_server):
+    server = make_server(retention={None: Retention(max_messages=2, policy=RetentionPolicy.EVICT_SUBSCRIBER)})
+    server.handle_subscription(1, "weather")
+    server.handle_subscription(2, "weather")
+    for content in (b"a", b"b"):
+        server.publish("weather", content)
+    server.handle_acknowledgement(2, 1, "weather")
+
+    server.publish("weather", b"c")
+    assert not server.state.is_subscribed(1, "weather")
+    assert server.state.is_subscribed(2, "weather")
+    assert server.metrics.counters['evicted_subscribers'] == 1
+
+    server.replies()
+    server.handle_get(1, "weather", 0)
+    assert server.replies() == [(1, "weather", NOT_SUBSCRIBED, [])]
+
+
+def test_reject_publisher_faults_the_publications_once_there_is_room(make_server):
+    server = make_server(retention={None: Retention(max_messages=2, policy=RetentionPolicy.REJECT_PUBLISHER)})
+    server.handle_subscription(1, "weather")
+    for content in (b"a", b"b", b"c"):
+        server.publish("weather", content)
+
+    assert len(server.state.topic_dict["weather"]) == 2
+    assert server.metrics.counters['rejected_publications'] == 1
+    assert not any(socket is server.fault_pub for socket, _ in server.outbox)
+
+    server.handle_acknowledgement(1, 1, "weather")
+    faults = [frames for socket, frames in server.outbox if socket is server.fault_pub]
+    assert [[bytes(frame) for frame in frames] for frames in faults] == [[b"1", b"weather", b"2", b"2"]]
@@ -0,0 +1,39 @@
+import os
+
+from service.programs.state.server_state import ServerState
+
+
+def test_topic_created_again_keeps_its_segments(tmp_path):
+    data_path = str(tmp_path / "server.pickle")
+    state = ServerState.read_state(data_path)
+    state.add_subscriber(1, "weather")
+    state.add_message("weather", b"hello")
+    state.remove_subscriber(1, "weather")
+
+    # The segments of the removed topic are only removed by the commit, after the topic is created again
+    state.add_subscriber(1, "weather")
+    state.add_message("weather", b"world")
+    state.commit()
+    assert bytes(state.topic_dict["weather"].get(0)) == b"world"
+
+    state.save_state()
+    restored = ServerState.read_state(data_path)
+    assert bytes(restored.topic_dict["weather"].get(0)) == b"world"
+    assert all(os.path.exists(segment.path) for segment in restored.topic_dict["weather"].segments)
+
+
+def test_topic_created_again_after_replay(tmp_path):
+    data_path = str(tmp_path / "server.pickle")
+    state = ServerState.read_state(data_path)
+    state.add_subscriber(1, "weather")
+    state.add_message("weather", b"hello")
+    state.remove_subscriber(1, "weather")
+    state.add_subscriber(1, "weather")
+    state.add_message("weather", b"world")
+    state.commit()
+
+    # Without a snapshot the journal creates the topic twice again
+    restored = ServerState.read_state(data_path)
+    restored.commit()
+    assert bytes(restored.topic_dict["weather"].get(0)) == b"world"
+    assert all(os.path.exists(segment.path) for segment in restored.topic_dict["weather"].segments)
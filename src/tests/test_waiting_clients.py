@@ -0,0 +1,88 @@
+import time
+
+from service.programs.state.waiting_index import WaitingIndex
+
+
+def test_waiting_index_pops_the_requests_in_order():
+    index = WaitingIndex()
+    index.add(5, 1)
+    index.add(3, 2)
+    index.add(3, 3)
+    index.add(9, 4)
+    index.remove(5, 1)
+
+    assert index.minimum() == 3
+    assert index.pop_until(6) == [(3, {2, 3})]
+    assert index.minimum() == 9
+    assert index.pop_until(8) == []
+    assert len(index) == 1
+
+
+def test_waiting_index_request_added_again():
+    index = WaitingIndex()
+    index.add(3, 1)
+    index.remove(3, 1)
+    index.add(3, 2)
+
+    assert index.pop_until(3) == [(3, {2})]
+    assert index.minimum() == float('inf')
+
+
+def test_publication_wakes_only_the_clients_it_satisfies(make_server):
+    server = make_server()
+    server.handle_subscription(1, "weather")
+    server.handle_subscription(2, "weather")
+    server.handle_get(1, "weather", 0)
+    # The client asks for messages the server does not have yet, its ACKs were lost
+    server.handle_get(2, "weather", 2)
+
+    server.publish("weather", b"a")
+    assert server.replies() == [(1, "weather", 0, ["a"])]
+    assert server.state.is_sub_waiting(2, "weather")
+
+    server.publish("weather", b"b")
+    assert server.replies() == []
+    server.publish("weather", b"c")
+    assert server.replies() == [(2, "weather", 2, ["c"])]
+    assert not server.state.is_sub_waiting(2, "weather")
+
+
+def test_get_expires_with_an_empty_run(make_server):
+    server = make_server()
+    server.handle_subscription(1, "weather")
+    server.handle_get(1, "weather", 0, wait=50)
+    server.expire_gets()
+    assert server.replies() == []
+
+    time.sleep(0.06)
+    server.expire_gets()
+    assert server.replies() == [(1, "weather", 0, [])]
+    assert not server.state.is_sub_waiting(1, "weather")
+    assert server.metrics.counters['expired_gets'] == 1
+
+
+def test_answered_get_does_not_expire(make_server):
+    server = make_server()
+    server.handle_subscription(1, "weather")
+    server.handle_get(1, "weather", 0, wait=50)
+    server.publish("weather", b"a")
+    assert server.replies() == [(1, "weather", 0, ["a"])]
+
+    time.sleep(0.06)
+    server.expire_gets()
+    assert server.replies() == []
+    assert 'expired_gets' not in server.metrics.counters
+
+
+def test_multi_get_expires_once(make_server):
+    server = make_server()
+    server.handle_subscription(1, "weather")
+    server.handle_subscription(1, "covid")
+    server.handle_multi_get(1, [("weather", 0), ("covid", 0)], 10, 0, 50)
+    assert server.state.is_sub_waiting(1, "weather") and server.state.is_sub_waiting(1, "covid")
+
+    time.sleep(0.06)
+    server.expire_gets()
+    assert len(server.replies()) == 1
+    assert not server.state.is_sub_waiting(1, "weather")
+    assert not server.state.is_sub_waiting(1, "covid")